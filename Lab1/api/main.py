@@ -1,12 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from datetime import date, timedelta
+import codecs
+import csv
+import json
 import sqlite3
+import threading
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/library.db")
 
+# stronicowanie list (keyset po id, bez OFFSET)
+PAGE_LIMIT_DEFAULT = 50
+PAGE_LIMIT_MAX = 500
+
+# import masowy (NDJSON / CSV)
+IMPORT_BATCH_SIZE = 5000
+IMPORT_MAX_ERRORS = 1000
+
+# okresowy snapshot przeterminowanych wypożyczeń (0 = wyłączony)
+OVERDUE_SCAN_INTERVAL = int(os.environ.get("OVERDUE_SCAN_INTERVAL", "3600"))
+OVERDUE_SNAPSHOT_DAYS = int(os.environ.get("OVERDUE_SNAPSHOT_DAYS", "30"))
+
 app = FastAPI()
 
 app.add_middleware(
@@ -37,7 +54,8 @@ def init_db():
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       title TEXT NOT NULL,
       author TEXT NOT NULL,
-      copies INTEGER NOT NULL DEFAULT 1 CHECK (copies >= 0)
+      copies INTEGER NOT NULL DEFAULT 1 CHECK (copies >= 0),
+      active_loans INTEGER NOT NULL DEFAULT 0 CHECK (active_loans >= 0)
     );
 
     CREATE TABLE IF NOT EXISTS loans (
@@ -49,12 +67,134 @@ def init_db():
       return_date TEXT NULL
     );
     """)
+    ensure_active_loans_column(conn)
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_loans_active_book
+      ON loans(book_id) WHERE return_date IS NULL;
+
+    CREATE INDEX IF NOT EXISTS idx_loans_active_due
+      ON loans(due_date) WHERE return_date IS NULL;
+
+    -- dzienny snapshot przeterminowanych wypożyczeń (dla raportów i przypomnień)
+    CREATE TABLE IF NOT EXISTS overdue_snapshots (
+      snapshot_date TEXT NOT NULL,
+      loan_id INTEGER NOT NULL,
+      member_id INTEGER NOT NULL,
+      book_id INTEGER NOT NULL,
+      due_date TEXT NOT NULL,
+      PRIMARY KEY (snapshot_date, loan_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_overdue_snapshots_member
+      ON overdue_snapshots(snapshot_date, member_id);
+
+    -- licznik aktywnych wypożyczeń w books.active_loans, aktualizowany
+    -- w tej samej transakcji co zmiana w loans
+    CREATE TRIGGER IF NOT EXISTS trg_loans_active_insert
+    AFTER INSERT ON loans WHEN NEW.return_date IS NULL
+    BEGIN
+      UPDATE books SET active_loans = active_loans + 1 WHERE id = NEW.book_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_loans_active_update
+    AFTER UPDATE OF return_date, book_id ON loans
+    BEGIN
+      UPDATE books SET active_loans = active_loans - 1
+      WHERE id = OLD.book_id AND OLD.return_date IS NULL;
+      UPDATE books SET active_loans = active_loans + 1
+      WHERE id = NEW.book_id AND NEW.return_date IS NULL;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_loans_active_delete
+    AFTER DELETE ON loans WHEN OLD.return_date IS NULL
+    BEGIN
+      UPDATE books SET active_loans = active_loans - 1 WHERE id = OLD.book_id;
+    END;
+    """)
     conn.commit()
     conn.close()
 
+# --------- Licznik dostępności ---------
+def ensure_active_loans_column(conn: sqlite3.Connection):
+    # starsze bazy nie mają kolumny active_loans - dodajemy ją i przeliczamy
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(books)")}
+    if "active_loans" not in cols:
+        conn.execute(
+            "ALTER TABLE books ADD COLUMN active_loans INTEGER NOT NULL DEFAULT 0 CHECK (active_loans >= 0)"
+        )
+        rebuild_active_loans(conn)
+
+def check_active_loans(conn: sqlite3.Connection):
+    rows = conn.execute("""
+      SELECT b.id, b.active_loans AS stored, COALESCE(al.active_loans, 0) AS actual
+      FROM books b
+      LEFT JOIN (
+        SELECT book_id, COUNT(*) AS active_loans
+        FROM loans
+        WHERE return_date IS NULL
+        GROUP BY book_id
+      ) al ON al.book_id = b.id
+      WHERE b.active_loans <> COALESCE(al.active_loans, 0)
+      ORDER BY b.id
+    """).fetchall()
+    return [dict(r) for r in rows]
+
+def rebuild_active_loans(conn: sqlite3.Connection):
+    cur = conn.execute("""
+      UPDATE books
+      SET active_loans = (
+        SELECT COUNT(*) FROM loans
+        WHERE loans.book_id = books.id AND loans.return_date IS NULL
+      )
+    """)
+    return cur.rowcount
+
+# --------- Snapshot przeterminowanych ---------
+def take_overdue_snapshot(conn: sqlite3.Connection, day: date):
+    # przebudowa snapshotu dla danego dnia; skan tylko po indeksie częściowym
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute("DELETE FROM overdue_snapshots WHERE snapshot_date = ?", (day.isoformat(),))
+        cur = conn.execute("""
+          INSERT INTO overdue_snapshots(snapshot_date, loan_id, member_id, book_id, due_date)
+          SELECT ?, id, member_id, book_id, due_date
+          FROM loans
+          WHERE return_date IS NULL AND due_date < ?
+        """, (day.isoformat(), day.isoformat()))
+        conn.execute(
+            "DELETE FROM overdue_snapshots WHERE snapshot_date < ?",
+            ((day - timedelta(days=OVERDUE_SNAPSHOT_DAYS)).isoformat(),),
+        )
+        conn.commit()
+        return cur.rowcount
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+
+overdue_scan_stop = threading.Event()
+
+def overdue_scan_loop():
+    while True:
+        conn = get_db()
+        try:
+            take_overdue_snapshot(conn, date.today())
+        except sqlite3.Error as e:
+            print(f"overdue snapshot failed: {e}")
+        finally:
+            conn.close()
+        if overdue_scan_stop.wait(OVERDUE_SCAN_INTERVAL):
+            return
+
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if OVERDUE_SCAN_INTERVAL > 0:
+        overdue_scan_stop.clear()
+        threading.Thread(target=overdue_scan_loop, name="overdue-scan", daemon=True).start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    overdue_scan_stop.set()
 
 class MemberIn(BaseModel):
     name: str = Field(min_length=1)
@@ -73,12 +213,32 @@ class BorrowIn(BaseModel):
 class ReturnIn(BaseModel):
     loan_id: int
 
+def page(rows, limit: int):
+    # pobieramy limit + 1 wierszy, żeby wiedzieć czy jest kolejna strona
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def before_clause(column: str, before_id: int | None):
+    if before_id is None:
+        return "", ()
+    return f"WHERE {column} < ?", (before_id,)
+
 @app.get("/api/members")
-def list_members():
+def list_members(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    before_id: int | None = Query(default=None, ge=1),
+):
+    where, params = before_clause("id", before_id)
     conn = get_db()
-    rows = conn.execute("SELECT id, name, email FROM members ORDER BY id DESC").fetchall()
+    rows = conn.execute(f"""
+      SELECT id, name, email FROM members
+      {where}
+      ORDER BY id DESC
+      LIMIT ?
+    """, (*params, limit + 1)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return page(rows, limit)
 
 @app.post("/api/members", status_code=201)
 def add_member(m: MemberIn):
@@ -97,23 +257,23 @@ def add_member(m: MemberIn):
         conn.close()
 
 @app.get("/api/books")
-def list_books():
+def list_books(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    before_id: int | None = Query(default=None, ge=1),
+):
+    where, params = before_clause("b.id", before_id)
     conn = get_db()
-    rows = conn.execute("""
+    rows = conn.execute(f"""
       SELECT
         b.id, b.title, b.author, b.copies,
-        (b.copies - COALESCE(al.active_loans, 0)) AS available
+        (b.copies - b.active_loans) AS available
       FROM books b
-      LEFT JOIN (
-        SELECT book_id, COUNT(*) AS active_loans
-        FROM loans
-        WHERE return_date IS NULL
-        GROUP BY book_id
-      ) al ON al.book_id = b.id
+      {where}
       ORDER BY b.id DESC
-    """).fetchall()
+      LIMIT ?
+    """, (*params, limit + 1)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return page(rows, limit)
 
 @app.post("/api/books", status_code=201)
 def add_book(b: BookIn):
@@ -127,10 +287,162 @@ def add_book(b: BookIn):
     conn.close()
     return {"id": new_id}
 
+# --------- Import masowy ---------
+async def iter_lines(request: Request):
+    # czytamy body kawałkami, bez wczytywania całości do pamięci; dzielimy po bajtach
+    # (bajt \n nie występuje wewnątrz znaku UTF-8), dekodowanie jest per linia
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if buf:
+        yield buf.rstrip(b"\r")
+
+async def iter_records(request: Request, fmt: str):
+    # zwraca (nr_linii, rekord, błąd); w CSV pierwsza linia to nagłówek
+    header = None
+    line_no = 0
+    async for raw in iter_lines(request):
+        line_no += 1
+        if line_no == 1:
+            # BOM z eksportu CSV (np. Excel) nie może trafić do nazwy pierwszej kolumny
+            raw = raw.removeprefix(codecs.BOM_UTF8)
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            yield line_no, None, "invalid utf-8"
+            continue
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            row = next(csv.reader([line]))
+            if header is None:
+                header = [h.strip().lower() for h in row]
+                continue
+            if len(row) != len(header):
+                yield line_no, None, f"expected {len(header)} columns, got {len(row)}"
+                continue
+            yield line_no, dict(zip(header, row)), None
+        else:
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"invalid json: {e.msg}"
+                continue
+            if not isinstance(obj, dict):
+                yield line_no, None, "expected a json object"
+                continue
+            yield line_no, obj, None
+
+def validation_message(e: ValidationError):
+    err = e.errors()[0]
+    loc = ".".join(str(x) for x in err["loc"])
+    return f"{loc}: {err['msg']}" if loc else err["msg"]
+
+def import_members_batch(batch):
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        emails = [m.email.strip().lower() for _, m in batch]
+
+        # duplikaty (w bazie i w samej paczce) raportujemy per linia zamiast
+        # przerywać executemany na pierwszym IntegrityError
+        taken = set()
+        for i in range(0, len(emails), 500):
+            chunk = emails[i:i + 500]
+            taken.update(r["email"] for r in conn.execute(
+                f"SELECT email FROM members WHERE email IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+
+        rows, errors = [], []
+        for (line_no, m), email in zip(batch, emails):
+            if email in taken:
+                errors.append({"line": line_no, "error": "email already exists"})
+                continue
+            taken.add(email)
+            rows.append((m.name.strip(), email))
+
+        conn.executemany("INSERT INTO members(name, email) VALUES(?, ?)", rows)
+        conn.commit()
+        return len(rows), errors
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def import_books_batch(batch):
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        conn.executemany(
+            "INSERT INTO books(title, author, copies) VALUES(?, ?, ?)",
+            [(b.title.strip(), b.author.strip(), b.copies) for _, b in batch],
+        )
+        conn.commit()
+        return len(batch), []
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+async def run_import(request: Request, fmt: str | None, model, import_batch):
+    if fmt is None:
+        fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    result = {"inserted": 0, "failed": 0, "errors": []}
+
+    def fail(errors):
+        result["failed"] += len(errors)
+        room = IMPORT_MAX_ERRORS - len(result["errors"])
+        result["errors"].extend(errors[:max(room, 0)])
+
+    async def flush(batch):
+        inserted, errors = await run_in_threadpool(import_batch, batch)
+        result["inserted"] += inserted
+        fail(errors)
+
+    batch = []
+    async for line_no, obj, err in iter_records(request, fmt):
+        if err:
+            fail([{"line": line_no, "error": err}])
+            continue
+        try:
+            batch.append((line_no, model.model_validate(obj)))
+        except ValidationError as e:
+            fail([{"line": line_no, "error": validation_message(e)}])
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    result["errors"].sort(key=lambda e: e["line"])
+    return result
+
+@app.post("/api/members/import")
+async def import_members(request: Request, format: str | None = Query(default=None, pattern="^(ndjson|csv)$")):
+    return await run_import(request, format, MemberIn, import_members_batch)
+
+@app.post("/api/books/import")
+async def import_books(request: Request, format: str | None = Query(default=None, pattern="^(ndjson|csv)$")):
+    return await run_import(request, format, BookIn, import_books_batch)
+
 @app.get("/api/loans")
-def list_loans():
+def list_loans(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    before_id: int | None = Query(default=None, ge=1),
+):
+    where, params = before_clause("l.id", before_id)
     conn = get_db()
-    rows = conn.execute("""
+    rows = conn.execute(f"""
       SELECT
         l.id,
         l.loan_date, l.due_date, l.return_date,
@@ -139,62 +451,189 @@ def list_loans():
       FROM loans l
       JOIN members m ON m.id = l.member_id
       JOIN books b ON b.id = l.book_id
+      {where}
       ORDER BY l.id DESC
-    """).fetchall()
+      LIMIT ?
+    """, (*params, limit + 1)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return page(rows, limit)
+
+# --------- Przeterminowane ---------
+def parse_overdue_cursor(after: str):
+    # kursor "YYYY-MM-DD:id" - pozycja w indeksie (due_date, id)
+    try:
+        due, loan_id = after.split(":")
+        return date.fromisoformat(due).isoformat(), int(loan_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+@app.get("/api/loans/overdue")
+def list_overdue(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    after: str | None = None,
+):
+    today = date.today().isoformat()
+    where, params = "", ()
+    if after is not None:
+        where, params = "AND (l.due_date, l.id) > (?, ?)", parse_overdue_cursor(after)
 
-@app.post("/api/loans/borrow", status_code=201)
-def borrow(req: BorrowIn):
     conn = get_db()
+    rows = conn.execute(f"""
+      SELECT
+        l.id,
+        l.loan_date, l.due_date,
+        CAST(julianday(?) - julianday(l.due_date) AS INTEGER) AS days_overdue,
+        m.id AS member_id, m.name AS member_name, m.email AS member_email,
+        b.id AS book_id, b.title AS book_title, b.author AS book_author
+      FROM loans l
+      JOIN members m ON m.id = l.member_id
+      JOIN books b ON b.id = l.book_id
+      WHERE l.return_date IS NULL AND l.due_date < ? {where}
+      ORDER BY l.due_date, l.id
+      LIMIT ?
+    """, (today, today, *params, limit + 1)).fetchall()
+    conn.close()
 
-    # sprawdź czy member i book istnieją
-    m = conn.execute("SELECT id FROM members WHERE id = ?", (req.member_id,)).fetchone()
-    if not m:
-        conn.close()
-        raise HTTPException(status_code=404, detail="member not found")
-    b = conn.execute("SELECT id, copies FROM books WHERE id = ?", (req.book_id,)).fetchone()
-    if not b:
-        conn.close()
-        raise HTTPException(status_code=404, detail="book not found")
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = f"{items[-1]['due_date']}:{items[-1]['id']}"
+    return {"items": items, "next_cursor": next_cursor}
 
-    active = conn.execute(
-        "SELECT COUNT(*) AS c FROM loans WHERE book_id = ? AND return_date IS NULL",
-        (req.book_id,),
-    ).fetchone()["c"]
+@app.get("/api/loans/overdue/members")
+def overdue_by_member(limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX)):
+    today = date.today().isoformat()
+    conn = get_db()
+    rows = conn.execute("""
+      SELECT m.id AS member_id, m.name, m.email, o.overdue, o.oldest_due_date
+      FROM (
+        SELECT member_id, COUNT(*) AS overdue, MIN(due_date) AS oldest_due_date
+        FROM loans
+        WHERE return_date IS NULL AND due_date < ?
+        GROUP BY member_id
+      ) o
+      JOIN members m ON m.id = o.member_id
+      ORDER BY o.overdue DESC, o.oldest_due_date, m.id
+      LIMIT ?
+    """, (today, limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
 
-    if active >= b["copies"]:
-        conn.close()
-        raise HTTPException(status_code=409, detail="no copies available")
+@app.get("/api/loans/overdue/snapshot")
+def overdue_snapshot(day: date | None = None):
+    conn = get_db()
+    if day is None:
+        latest = conn.execute("SELECT MAX(snapshot_date) AS d FROM overdue_snapshots").fetchone()["d"]
+        if latest is None:
+            conn.close()
+            raise HTTPException(status_code=404, detail="no snapshot yet")
+        day = date.fromisoformat(latest)
 
+    rows = conn.execute("""
+      SELECT s.member_id, m.name, m.email, COUNT(*) AS overdue, MIN(s.due_date) AS oldest_due_date
+      FROM overdue_snapshots s
+      JOIN members m ON m.id = s.member_id
+      WHERE s.snapshot_date = ?
+      GROUP BY s.member_id
+      ORDER BY overdue DESC, oldest_due_date, s.member_id
+    """, (day.isoformat(),)).fetchall()
+    conn.close()
+    members = [dict(r) for r in rows]
+    return {
+        "day": day.isoformat(),
+        "loans": sum(r["overdue"] for r in members),
+        "members": members,
+    }
+
+@app.post("/api/loans/borrow", status_code=201)
+def borrow(req: BorrowIn):
     loan_dt = date.today()
     due_dt = loan_dt + timedelta(days=req.days or 14)
 
-    cur = conn.execute("""
-      INSERT INTO loans(member_id, book_id, loan_date, due_date, return_date)
-      VALUES(?, ?, ?, ?, NULL)
-    """, (req.member_id, req.book_id, loan_dt.isoformat(), due_dt.isoformat()))
-    conn.commit()
-    new_id = cur.lastrowid
-    conn.close()
-    return {"id": new_id}
+    conn = get_db()
+    try:
+        # BEGIN IMMEDIATE od razu bierze blokadę zapisu, a warunkowy INSERT
+        # sprawdza członka, książkę i dostępność w tym samym kroku co zapis
+        conn.execute("BEGIN IMMEDIATE;")
+        cur = conn.execute("""
+          INSERT INTO loans(member_id, book_id, loan_date, due_date, return_date)
+          SELECT m.id, b.id, ?, ?, NULL
+          FROM members m, books b
+          WHERE m.id = ? AND b.id = ? AND b.active_loans < b.copies
+        """, (loan_dt.isoformat(), due_dt.isoformat(), req.member_id, req.book_id))
+
+        if cur.rowcount == 0:
+            # nic nie wstawiono - ustalamy przyczynę (tylko na ścieżce błędu)
+            m = conn.execute("SELECT id FROM members WHERE id = ?", (req.member_id,)).fetchone()
+            if not m:
+                raise HTTPException(status_code=404, detail="member not found")
+            b = conn.execute("SELECT id FROM books WHERE id = ?", (req.book_id,)).fetchone()
+            if not b:
+                raise HTTPException(status_code=404, detail="book not found")
+            raise HTTPException(status_code=409, detail="no copies available")
+
+        new_id = cur.lastrowid
+        conn.commit()
+        return {"id": new_id}
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 @app.post("/api/loans/return")
 def return_loan(req: ReturnIn):
     conn = get_db()
-    row = conn.execute("SELECT id, return_date FROM loans WHERE id = ?", (req.loan_id,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="loan not found")
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        cur = conn.execute(
+            "UPDATE loans SET return_date = ? WHERE id = ? AND return_date IS NULL",
+            (date.today().isoformat(), req.loan_id),
+        )
+        if cur.rowcount == 0:
+            row = conn.execute("SELECT id FROM loans WHERE id = ?", (req.loan_id,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="loan not found")
+            raise HTTPException(status_code=409, detail="already returned")
+        conn.commit()
+        return {"ok": True}
 
-    if row["return_date"] is not None:
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        raise HTTPException(status_code=409, detail="already returned")
 
-    conn.execute(
-        "UPDATE loans SET return_date = ? WHERE id = ?",
-        (date.today().isoformat(), req.loan_id),
-    )
-    conn.commit()
+# --------- CLI (utrzymanie bazy) ---------
+# docker compose exec api python main.py check-availability
+# docker compose exec api python main.py rebuild-availability
+# docker compose exec api python main.py snapshot-overdue
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Lab1 - narzędzia bazy danych")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("check-availability", help="porównaj books.active_loans z tabelą loans")
+    sub.add_parser("rebuild-availability", help="przelicz books.active_loans z tabeli loans")
+    sub.add_parser("snapshot-overdue", help="zapisz dzisiejszy snapshot przeterminowanych wypożyczeń")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db()
+    if args.cmd == "check-availability":
+        bad = check_active_loans(conn)
+        for r in bad:
+            print(f"book {r['id']}: stored={r['stored']} actual={r['actual']}")
+        print(f"{len(bad)} inconsistent book(s)")
+        conn.close()
+        sys.exit(1 if bad else 0)
+    elif args.cmd == "rebuild-availability":
+        n = rebuild_active_loans(conn)
+        conn.commit()
+        print(f"rebuilt active_loans for {n} book(s)")
+    elif args.cmd == "snapshot-overdue":
+        n = take_overdue_snapshot(conn, date.today())
+        print(f"{n} overdue loan(s) in snapshot for {date.today().isoformat()}")
     conn.close()
-    return {"ok": True}
@@ -0,0 +1,97 @@
+"""Benchmark współbieżnych wypożyczeń jednej książki.
+
+N wątków jednocześnie wywołuje borrow() dla tej samej książki o `copies`
+egzemplarzach (każdy wątek to osobny członek i osobne połączenie z bazą).
+Raport: przepustowość, opóźnienie p50/p99 i liczba nadmiarowych wypożyczeń
+(oversell), która musi wynosić 0.
+
+Uruchomienie (z katalogu Lab1):
+    python bench/bench_borrow.py --borrowers 200 --copies 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--borrowers", type=int, default=200, help="liczba współbieżnych wypożyczeń")
+    parser.add_argument("--copies", type=int, default=20, help="liczba egzemplarzy książki")
+    parser.add_argument("--workers", type=int, default=32, help="rozmiar puli wątków")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DB_PATH"] = os.path.join(tmp.name, "library.db")
+    sys.path.insert(0, API_DIR)
+    import main as api
+    from fastapi import HTTPException
+
+    api.init_db()
+    conn = api.get_db()
+    conn.executemany(
+        "INSERT INTO members(name, email) VALUES(?, ?)",
+        [(f"bench {i}", f"bench{i}@example.com") for i in range(args.borrowers)],
+    )
+    book_id = conn.execute(
+        "INSERT INTO books(title, author, copies) VALUES('bench', 'bench', ?)",
+        (args.copies,),
+    ).lastrowid
+    member_ids = [r["id"] for r in conn.execute("SELECT id FROM members ORDER BY id")]
+    conn.commit()
+    conn.close()
+
+    latencies = []
+    outcomes = {"ok": 0, "conflict": 0, "error": 0}
+    lock = threading.Lock()
+
+    def one(member_id):
+        t0 = time.perf_counter()
+        try:
+            api.borrow(api.BorrowIn(member_id=member_id, book_id=book_id, days=14))
+            result = "ok"
+        except HTTPException as e:
+            result = "conflict" if e.status_code == 409 else "error"
+        except Exception:
+            result = "error"
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            outcomes[result] += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(one, member_ids))
+    wall = time.perf_counter() - t0
+
+    conn = api.get_db()
+    active = conn.execute(
+        "SELECT COUNT(*) AS c FROM loans WHERE book_id = ? AND return_date IS NULL",
+        (book_id,),
+    ).fetchone()["c"]
+    counter = conn.execute("SELECT active_loans FROM books WHERE id = ?", (book_id,)).fetchone()[0]
+    conn.close()
+    oversell = max(0, active - args.copies)
+
+    print(f"borrowers:   {args.borrowers} (workers={args.workers}, copies={args.copies})")
+    print(f"outcomes:    ok={outcomes['ok']} 409={outcomes['conflict']} errors={outcomes['error']}")
+    print(f"throughput:  {args.borrowers / wall:.0f} req/s ({wall * 1000:.1f} ms total)")
+    print(f"latency:     p50={percentile(latencies, 50) * 1000:.2f} ms p99={percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"oversell:    {oversell} (active loans={active}, counter={counter})")
+    tmp.cleanup()
+    sys.exit(1 if oversell or counter != active else 0)
+
+
+if __name__ == "__main__":
+    main()
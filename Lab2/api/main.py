@@ -1,12 +1,21 @@
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from datetime import datetime, timezone
+from pydantic import BaseModel, Field, model_validator
+from typing import Literal
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import json
 import sqlite3
+import threading
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/shop.db")
 
+# koszyki per sesja (nagłówek X-Cart-Id); bez nagłówka - wspólny koszyk "default"
+DEFAULT_CART_ID = "default"
+CART_IDLE_TTL = int(os.environ.get("CART_IDLE_TTL", str(7 * 24 * 3600)))
+CART_EVICT_INTERVAL = int(os.environ.get("CART_EVICT_INTERVAL", "600"))
+
 app = FastAPI()
 
 app.add_middleware(
@@ -26,6 +35,7 @@ def get_db():
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = get_db()
+    rollups_missing = not has_table(conn, "sales_daily")
     conn.executescript("""
     CREATE TABLE IF NOT EXISTS products (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -46,18 +56,123 @@ def init_db():
       price REAL NOT NULL CHECK (price >= 0)
     );
 
-    -- pomocnicza tabela dla koszyka (1 globalny koszyk)
+    CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+
+    -- koszyki per sesja; updated_at służy do usuwania porzuconych koszyków
+    CREATE TABLE IF NOT EXISTS carts (
+      id TEXT PRIMARY KEY,
+      updated_at TEXT NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_carts_updated ON carts(updated_at);
+    """)
+    migrate_cart_items(conn)
+    conn.executescript("""
     CREATE TABLE IF NOT EXISTS cart_items (
-      product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
-      qty INTEGER NOT NULL CHECK (qty >= 1)
+      cart_id TEXT NOT NULL REFERENCES carts(id) ON DELETE CASCADE,
+      product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+      qty INTEGER NOT NULL CHECK (qty >= 1),
+      PRIMARY KEY (cart_id, product_id)
+    ) WITHOUT ROWID;
+
+    -- dla kaskady przy usuwaniu produktu
+    CREATE INDEX IF NOT EXISTS idx_cart_items_product ON cart_items(product_id);
+
+    -- wersja katalogu, podbijana przy każdej zmianie w products (cache + ETag)
+    CREATE TABLE IF NOT EXISTS catalog_version (
+      id INTEGER PRIMARY KEY CHECK (id = 1),
+      version INTEGER NOT NULL
     );
+    INSERT OR IGNORE INTO catalog_version(id, version) VALUES(1, 0);
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_version_insert AFTER INSERT ON products
+    BEGIN
+      UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_version_update AFTER UPDATE ON products
+    BEGIN
+      UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_products_version_delete AFTER DELETE ON products
+    BEGIN
+      UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END;
+
+    -- dzienne agregaty sprzedaży, aktualizowane w checkout (day = data UTC z orders.created_at)
+    CREATE TABLE IF NOT EXISTS sales_daily (
+      day TEXT PRIMARY KEY,
+      orders INTEGER NOT NULL,
+      items INTEGER NOT NULL,
+      revenue REAL NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS sales_daily_product (
+      day TEXT NOT NULL,
+      product_id INTEGER NOT NULL,
+      orders INTEGER NOT NULL,
+      qty INTEGER NOT NULL,
+      revenue REAL NOT NULL,
+      PRIMARY KEY (day, product_id)
+    ) WITHOUT ROWID;
     """)
+    if has_table(conn, "cart_items_legacy"):
+        conn.execute("""
+          INSERT INTO cart_items(cart_id, product_id, qty)
+          SELECT ?, product_id, qty FROM cart_items_legacy
+        """, (DEFAULT_CART_ID,))
+        conn.execute("DROP TABLE cart_items_legacy")
     conn.commit()
+    if rollups_missing:
+        backfill_rollups(conn)
     conn.close()
 
+def has_table(conn: sqlite3.Connection, name: str):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+def migrate_cart_items(conn: sqlite3.Connection):
+    # stary schemat: jeden globalny koszyk (product_id jako PK) -> przenosimy go do koszyka "default"
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(cart_items)")}
+    if cols and "cart_id" not in cols:
+        conn.execute("ALTER TABLE cart_items RENAME TO cart_items_legacy")
+        conn.execute(
+            "INSERT OR IGNORE INTO carts(id, updated_at) VALUES(?, ?)",
+            (DEFAULT_CART_ID, datetime.now(timezone.utc).isoformat()),
+        )
+
+# --------- Usuwanie porzuconych koszyków ---------
+def evict_idle_carts(conn: sqlite3.Connection, ttl_seconds: int):
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)).isoformat()
+    cur = conn.execute("DELETE FROM carts WHERE updated_at < ?", (cutoff,))
+    conn.commit()
+    return cur.rowcount
+
+cart_evict_stop = threading.Event()
+
+def cart_evict_loop():
+    while not cart_evict_stop.wait(CART_EVICT_INTERVAL):
+        conn = get_db()
+        try:
+            evict_idle_carts(conn, CART_IDLE_TTL)
+        except sqlite3.Error as e:
+            print(f"cart eviction failed: {e}")
+        finally:
+            conn.close()
+
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if CART_EVICT_INTERVAL > 0:
+        cart_evict_stop.clear()
+        threading.Thread(target=cart_evict_loop, name="cart-evict", daemon=True).start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    cart_evict_stop.set()
 
 # --------- Schemy ---------
 class ProductIn(BaseModel):
@@ -72,13 +187,59 @@ class CartPatchIn(BaseModel):
     product_id: int
     qty: int = Field(ge=1)
 
+class CartOpIn(BaseModel):
+    op: Literal["add", "set", "remove"]
+    product_id: int
+    qty: int | None = Field(default=None, ge=1)
+
+    @model_validator(mode="after")
+    def qty_required(self):
+        if self.op == "set" and self.qty is None:
+            raise ValueError("qty is required for set")
+        return self
+
+class CartBatchIn(BaseModel):
+    ops: list[CartOpIn] = Field(min_length=1, max_length=500)
+
 # --------- Produkty ---------
-@app.get("/api/products")
-def get_products():
+# zserializowany katalog trzymany w pamięci dopóki nie zmieni się catalog_version
+catalog_cache = {"version": None, "body": b"", "etag": ""}
+catalog_lock = threading.Lock()
+
+def catalog_snapshot():
     conn = get_db()
-    rows = conn.execute("SELECT id, name, price FROM products ORDER BY id DESC").fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    try:
+        conn.execute("BEGIN;")
+        version = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()["version"]
+        with catalog_lock:
+            if catalog_cache["version"] == version:
+                return catalog_cache["body"], catalog_cache["etag"]
+
+        rows = conn.execute("SELECT id, name, price FROM products ORDER BY id DESC").fetchall()
+        body = json.dumps(
+            [dict(r) for r in rows], ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with catalog_lock:
+            catalog_cache.update(version=version, body=body, etag=etag)
+        return body, etag
+    finally:
+        conn.rollback()
+        conn.close()
+
+def etag_matches(if_none_match: str | None, etag: str):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+@app.get("/api/products")
+def get_products(request: Request):
+    body, etag = catalog_snapshot()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/api/products", status_code=201)
 def add_product(p: ProductIn):
@@ -119,7 +280,16 @@ def delete_product(product_id: int):
     return Response(status_code=204)
 
 # --------- Koszyk ---------
-def cart_view(conn: sqlite3.Connection):
+def get_cart_id(x_cart_id: str = Header(default=DEFAULT_CART_ID, pattern=r"^[A-Za-z0-9_-]{1,64}$")):
+    return x_cart_id
+
+def touch_cart(conn: sqlite3.Connection, cart_id: str):
+    conn.execute("""
+      INSERT INTO carts(id, updated_at) VALUES(?, ?)
+      ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at
+    """, (cart_id, datetime.now(timezone.utc).isoformat()))
+
+def cart_view(conn: sqlite3.Connection, cart_id: str):
     rows = conn.execute("""
       SELECT
         ci.product_id,
@@ -129,102 +299,252 @@ def cart_view(conn: sqlite3.Connection):
         (p.price * ci.qty) AS line_total
       FROM cart_items ci
       JOIN products p ON p.id = ci.product_id
+      WHERE ci.cart_id = ?
       ORDER BY ci.product_id
-    """).fetchall()
+    """, (cart_id,)).fetchall()
     items = [dict(r) for r in rows]
     total = sum(i["line_total"] for i in items)
     return {"items": items, "total": total}
 
+def apply_cart_op(conn: sqlite3.Connection, cart_id: str, op: str, product_id: int, qty: int | None):
+    # upserty zamiast SELECT + INSERT/UPDATE
+    if op == "add":
+        conn.execute("""
+          INSERT INTO cart_items(cart_id, product_id, qty) VALUES(?, ?, ?)
+          ON CONFLICT(cart_id, product_id) DO UPDATE SET qty = qty + excluded.qty
+        """, (cart_id, product_id, qty or 1))
+    elif op == "set":
+        conn.execute("""
+          INSERT INTO cart_items(cart_id, product_id, qty) VALUES(?, ?, ?)
+          ON CONFLICT(cart_id, product_id) DO UPDATE SET qty = excluded.qty
+        """, (cart_id, product_id, qty))
+    elif op == "remove":
+        conn.execute(
+            "DELETE FROM cart_items WHERE cart_id = ? AND product_id = ?",
+            (cart_id, product_id),
+        )
+
 @app.get("/api/cart")
-def get_cart():
+def get_cart(cart_id: str = Depends(get_cart_id)):
     conn = get_db()
-    data = cart_view(conn)
+    data = cart_view(conn, cart_id)
     conn.close()
     return data
 
 @app.post("/api/cart/add")
-def cart_add(req: CartAddIn):
+def cart_add(req: CartAddIn, cart_id: str = Depends(get_cart_id)):
     conn = get_db()
     p = conn.execute("SELECT id FROM products WHERE id = ?", (req.product_id,)).fetchone()
     if not p:
         conn.close()
         raise HTTPException(status_code=404, detail="product not found")
 
-    existing = conn.execute("SELECT qty FROM cart_items WHERE product_id = ?", (req.product_id,)).fetchone()
-    if existing:
-        conn.execute(
-            "UPDATE cart_items SET qty = qty + ? WHERE product_id = ?",
-            (req.qty, req.product_id),
-        )
-    else:
-        conn.execute(
-            "INSERT INTO cart_items(product_id, qty) VALUES(?, ?)",
-            (req.product_id, req.qty),
-        )
+    touch_cart(conn, cart_id)
+    apply_cart_op(conn, cart_id, "add", req.product_id, req.qty)
     conn.commit()
-    data = cart_view(conn)
+    data = cart_view(conn, cart_id)
     conn.close()
     return data
 
 @app.patch("/api/cart/item")
-def cart_patch(req: CartPatchIn):
+def cart_patch(req: CartPatchIn, cart_id: str = Depends(get_cart_id)):
     conn = get_db()
-    existing = conn.execute("SELECT qty FROM cart_items WHERE product_id = ?", (req.product_id,)).fetchone()
-    if not existing:
+    cur = conn.execute(
+        "UPDATE cart_items SET qty = ? WHERE cart_id = ? AND product_id = ?",
+        (req.qty, cart_id, req.product_id),
+    )
+    if cur.rowcount == 0:
         conn.close()
         raise HTTPException(status_code=404, detail="cart item not found")
-    conn.execute("UPDATE cart_items SET qty = ? WHERE product_id = ?", (req.qty, req.product_id))
+    touch_cart(conn, cart_id)
     conn.commit()
-    data = cart_view(conn)
+    data = cart_view(conn, cart_id)
     conn.close()
     return data
 
 @app.delete("/api/cart/item/{product_id}")
-def cart_delete(product_id: int):
+def cart_delete(product_id: int, cart_id: str = Depends(get_cart_id)):
     conn = get_db()
-    cur = conn.execute("DELETE FROM cart_items WHERE product_id = ?", (product_id,))
-    conn.commit()
+    cur = conn.execute(
+        "DELETE FROM cart_items WHERE cart_id = ? AND product_id = ?",
+        (cart_id, product_id),
+    )
     if cur.rowcount == 0:
         conn.close()
         raise HTTPException(status_code=404, detail="cart item not found")
-    data = cart_view(conn)
+    touch_cart(conn, cart_id)
+    conn.commit()
+    data = cart_view(conn, cart_id)
     conn.close()
     return data
 
+# wiele zmian koszyka w jednej transakcji i jeden przeliczony widok na końcu;
+# remove dla pozycji spoza koszyka jest ignorowane, set tworzy brakującą pozycję
+@app.post("/api/cart/batch")
+def cart_batch(req: CartBatchIn, cart_id: str = Depends(get_cart_id)):
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+
+        wanted = sorted({o.product_id for o in req.ops if o.op != "remove"})
+        if wanted:
+            found = {r["id"] for r in conn.execute(
+                f"SELECT id FROM products WHERE id IN ({','.join('?' * len(wanted))})",
+                wanted,
+            )}
+            missing = [pid for pid in wanted if pid not in found]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"product not found: {missing[0]}")
+
+        touch_cart(conn, cart_id)
+        for o in req.ops:
+            apply_cart_op(conn, cart_id, o.op, o.product_id, o.qty)
+        conn.commit()
+        return cart_view(conn, cart_id)
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --------- Agregaty sprzedaży ---------
+def add_order_to_rollups(conn: sqlite3.Connection, order_id: int, day: str, items: int, revenue: float):
+    conn.execute("""
+      INSERT INTO sales_daily(day, orders, items, revenue) VALUES(?, 1, ?, ?)
+      ON CONFLICT(day) DO UPDATE SET
+        orders = orders + 1,
+        items = items + excluded.items,
+        revenue = revenue + excluded.revenue
+    """, (day, items, revenue))
+    conn.execute("""
+      INSERT INTO sales_daily_product(day, product_id, orders, qty, revenue)
+      SELECT ?, product_id, 1, SUM(qty), SUM(price * qty)
+      FROM order_items
+      WHERE order_id = ?
+      GROUP BY product_id
+      ON CONFLICT(day, product_id) DO UPDATE SET
+        orders = orders + 1,
+        qty = qty + excluded.qty,
+        revenue = revenue + excluded.revenue
+    """, (day, order_id))
+
+def backfill_rollups(conn: sqlite3.Connection):
+    # przebudowa agregatów z pełnej historii zamówień
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute("DELETE FROM sales_daily")
+        conn.execute("DELETE FROM sales_daily_product")
+        conn.execute("""
+          INSERT INTO sales_daily(day, orders, items, revenue)
+          SELECT substr(o.created_at, 1, 10), COUNT(DISTINCT o.id), SUM(oi.qty), SUM(oi.price * oi.qty)
+          FROM orders o
+          JOIN order_items oi ON oi.order_id = o.id
+          GROUP BY substr(o.created_at, 1, 10)
+        """)
+        cur = conn.execute("""
+          INSERT INTO sales_daily_product(day, product_id, orders, qty, revenue)
+          SELECT substr(o.created_at, 1, 10), oi.product_id, COUNT(DISTINCT o.id), SUM(oi.qty), SUM(oi.price * oi.qty)
+          FROM orders o
+          JOIN order_items oi ON oi.order_id = o.id
+          GROUP BY substr(o.created_at, 1, 10), oi.product_id
+        """)
+        conn.commit()
+        return cur.rowcount
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+
+def day_range(date_from: date | None, date_to: date | None):
+    lo = date_from.isoformat() if date_from else "0000-01-01"
+    hi = date_to.isoformat() if date_to else "9999-12-31"
+    return lo, hi
+
+@app.get("/api/reports/revenue")
+def revenue_by_day(
+    date_from: date | None = Query(default=None, alias="from"),
+    date_to: date | None = Query(default=None, alias="to"),
+):
+    conn = get_db()
+    rows = conn.execute("""
+      SELECT day, orders, items, revenue
+      FROM sales_daily
+      WHERE day BETWEEN ? AND ?
+      ORDER BY day
+    """, day_range(date_from, date_to)).fetchall()
+    conn.close()
+    days = [dict(r) for r in rows]
+    return {
+        "days": days,
+        "orders": sum(d["orders"] for d in days),
+        "revenue": sum(d["revenue"] for d in days),
+    }
+
+@app.get("/api/reports/top-products")
+def top_products(
+    date_from: date | None = Query(default=None, alias="from"),
+    date_to: date | None = Query(default=None, alias="to"),
+    by: Literal["revenue", "qty"] = "revenue",
+    limit: int = Query(default=10, ge=1, le=100),
+):
+    conn = get_db()
+    rows = conn.execute(f"""
+      SELECT s.product_id, p.name, SUM(s.orders) AS orders, SUM(s.qty) AS qty, SUM(s.revenue) AS revenue
+      FROM sales_daily_product s
+      LEFT JOIN products p ON p.id = s.product_id
+      WHERE s.day BETWEEN ? AND ?
+      GROUP BY s.product_id
+      ORDER BY {by} DESC, s.product_id
+      LIMIT ?
+    """, (*day_range(date_from, date_to), limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
 # --------- Checkout / Zamówienie ---------
 @app.post("/api/checkout", status_code=201)
-def checkout():
+def checkout(cart_id: str = Depends(get_cart_id)):
     conn = get_db()
     try:
-        conn.execute("BEGIN;")
+        # cały checkout to stała liczba zapytań niezależnie od liczby pozycji,
+        # więc blokada zapisu trzymana jest możliwie krótko
+        conn.execute("BEGIN IMMEDIATE;")
 
-        cart = conn.execute("SELECT product_id, qty FROM cart_items ORDER BY product_id").fetchall()
-        if not cart:
-            raise HTTPException(status_code=409, detail="cart is empty")
+        missing = conn.execute("""
+          SELECT ci.product_id
+          FROM cart_items ci
+          LEFT JOIN products p ON p.id = ci.product_id
+          WHERE ci.cart_id = ? AND p.id IS NULL
+          LIMIT 1
+        """, (cart_id,)).fetchone()
+        if missing:
+            raise HTTPException(status_code=409, detail=f"product missing: {missing['product_id']}")
 
         created_at = datetime.now(timezone.utc).isoformat()
         cur = conn.execute("INSERT INTO orders(created_at) VALUES(?)", (created_at,))
         order_id = cur.lastrowid
 
-        total = 0.0
-        for row in cart:
-            product_id = row["product_id"]
-            qty = row["qty"]
-
-            p = conn.execute("SELECT price FROM products WHERE id = ?", (product_id,)).fetchone()
-            if not p:
-                raise HTTPException(status_code=409, detail=f"product missing: {product_id}")
-
-            price_snapshot = float(p["price"])  # snapshot ceny
-            line_total = price_snapshot * qty
-            total += line_total
+        # snapshot cen z products w jednym INSERT ... SELECT
+        cur = conn.execute("""
+          INSERT INTO order_items(order_id, product_id, qty, price)
+          SELECT ?, ci.product_id, ci.qty, p.price
+          FROM cart_items ci
+          JOIN products p ON p.id = ci.product_id
+          WHERE ci.cart_id = ?
+          ORDER BY ci.product_id
+        """, (order_id, cart_id))
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=409, detail="cart is empty")
 
-            conn.execute("""
-              INSERT INTO order_items(order_id, product_id, qty, price)
-              VALUES(?, ?, ?, ?)
-            """, (order_id, product_id, qty, price_snapshot))
+        sums = conn.execute("""
+          SELECT COALESCE(SUM(price * qty), 0) AS total, COALESCE(SUM(qty), 0) AS items
+          FROM order_items
+          WHERE order_id = ?
+        """, (order_id,)).fetchone()
+        total = sums["total"]
+        add_order_to_rollups(conn, order_id, created_at[:10], sums["items"], total)
 
-        conn.execute("DELETE FROM cart_items")  # po checkout koszyk pusty
+        # po checkout koszyk pusty (cart_items usuwane kaskadowo)
+        conn.execute("DELETE FROM carts WHERE id = ?", (cart_id,))
         conn.commit()
         return {"order_id": order_id, "total": total}
 
@@ -232,7 +552,24 @@ def checkout():
         conn.execute("ROLLBACK;")
         raise
     except Exception:
-        conn.execute("ROLLBACK;")
+        conn.rollback()
         raise
     finally:
         conn.close()
+
+# --------- CLI (utrzymanie bazy) ---------
+# docker compose exec api python main.py backfill-sales
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lab2 - narzędzia bazy danych")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("backfill-sales", help="przebuduj agregaty sprzedaży z historii zamówień")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db()
+    if args.cmd == "backfill-sales":
+        n = backfill_rollups(conn)
+        print(f"rebuilt {n} day/product rollup row(s)")
+    conn.close()
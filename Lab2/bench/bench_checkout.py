@@ -0,0 +1,122 @@
+"""Benchmark checkoutu: zapytania per pozycja vs INSERT ... SELECT.
+
+Dla koszyków o 1, 50 i 500 pozycjach mierzy czas trzymania blokady zapisu
+(od BEGIN do COMMIT, z trace callbacka SQLite) i liczbę zamówień na sekundę.
+`legacy` to poprzednia implementacja (SELECT price + INSERT dla każdej
+pozycji), `set-based` to aktualny checkout() z api/main.py.
+
+Uruchomienie (z katalogu Lab2):
+    python bench/bench_checkout.py --rounds 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+CART_ID = "bench"
+
+
+def legacy_checkout(api):
+    conn = api.get_db()
+    try:
+        conn.execute("BEGIN;")
+        cart = conn.execute(
+            "SELECT product_id, qty FROM cart_items WHERE cart_id = ? ORDER BY product_id",
+            (CART_ID,),
+        ).fetchall()
+        created_at = datetime.now(timezone.utc).isoformat()
+        order_id = conn.execute("INSERT INTO orders(created_at) VALUES(?)", (created_at,)).lastrowid
+        total = 0.0
+        for row in cart:
+            p = conn.execute("SELECT price FROM products WHERE id = ?", (row["product_id"],)).fetchone()
+            price_snapshot = float(p["price"])
+            total += price_snapshot * row["qty"]
+            conn.execute(
+                "INSERT INTO order_items(order_id, product_id, qty, price) VALUES(?, ?, ?, ?)",
+                (order_id, row["product_id"], row["qty"], price_snapshot),
+            )
+        conn.execute("DELETE FROM carts WHERE id = ?", (CART_ID,))
+        conn.commit()
+        return {"order_id": order_id, "total": total}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200, help="liczba zamówień na rozmiar koszyka")
+    parser.add_argument("--sizes", default="1,50,500", help="rozmiary koszyka (liczba pozycji)")
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DB_PATH"] = os.path.join(tmp.name, "shop.db")
+    sys.path.insert(0, API_DIR)
+    import main as api
+
+    api.init_db()
+    conn = api.get_db()
+    conn.executemany(
+        "INSERT INTO products(name, price) VALUES(?, ?)",
+        [(f"product {i}", 1 + i % 100 / 4) for i in range(max(sizes))],
+    )
+    product_ids = [r["id"] for r in conn.execute("SELECT id FROM products ORDER BY id")]
+    conn.commit()
+    conn.close()
+
+    # czas trzymania blokady: od BEGIN do COMMIT/ROLLBACK na połączeniu checkoutu
+    lock_hold = []
+    plain_get_db = api.get_db
+
+    def traced_get_db():
+        c = plain_get_db()
+        state = {}
+
+        def trace(sql):
+            stmt = sql.strip().upper()
+            if stmt.startswith("BEGIN"):
+                state["t0"] = time.perf_counter()
+            elif stmt.startswith(("COMMIT", "ROLLBACK")) and "t0" in state:
+                lock_hold.append(time.perf_counter() - state.pop("t0"))
+
+        c.set_trace_callback(trace)
+        return c
+
+    def fill_cart(n):
+        c = plain_get_db()
+        api.touch_cart(c, CART_ID)
+        c.executemany(
+            "INSERT INTO cart_items(cart_id, product_id, qty) VALUES(?, ?, ?)",
+            [(CART_ID, pid, 1 + pid % 3) for pid in product_ids[:n]],
+        )
+        c.commit()
+        c.close()
+
+    variants = [("legacy", lambda: legacy_checkout(api)), ("set-based", lambda: api.checkout(cart_id=CART_ID))]
+
+    print(f"{'variant':<10} {'lines':>6} {'orders/s':>10} {'lock p50 ms':>12} {'lock p99 ms':>12}")
+    for size in sizes:
+        for name, fn in variants:
+            lock_hold.clear()
+            busy = 0.0
+            for _ in range(args.rounds):
+                api.get_db = plain_get_db
+                fill_cart(size)
+                api.get_db = traced_get_db
+                t0 = time.perf_counter()
+                fn()
+                busy += time.perf_counter() - t0
+            api.get_db = plain_get_db
+            lock_hold.sort()
+            p50 = lock_hold[len(lock_hold) // 2] * 1000
+            p99 = lock_hold[min(len(lock_hold) - 1, int(len(lock_hold) * 0.99))] * 1000
+            print(f"{name:<10} {size:>6} {args.rounds / busy:>10.0f} {p50:>12.3f} {p99:>12.3f}")
+
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime, timezone
+import asyncio
+import json
 import sqlite3
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/blog.db")
 
+# stronicowanie list (keyset po id, bez OFFSET)
+PAGE_LIMIT_DEFAULT = 20
+PAGE_LIMIT_MAX = 100
+FEED_COMMENTS_DEFAULT = 20
+FEED_COMMENTS_MAX = 100
+EXCERPT_LENGTH = 200
+BULK_IDS_MAX = 10000
+
+# SSE: bufor zdarzeń na subskrybenta i odstęp keep-alive
+SSE_QUEUE_SIZE = 100
+SSE_PING_INTERVAL = 15
+
 app = FastAPI()
 
 app.add_middleware(
@@ -41,6 +57,13 @@ def init_db():
       created_at TEXT NOT NULL,
       approved INTEGER NOT NULL DEFAULT 0
     );
+
+    CREATE INDEX IF NOT EXISTS idx_comments_post_approved
+      ON comments(post_id, approved, id);
+
+    -- kolejka moderacji: tylko komentarze oczekujące
+    CREATE INDEX IF NOT EXISTS idx_comments_pending
+      ON comments(id) WHERE approved = 0;
     """)
     conn.commit()
     conn.close()
@@ -58,17 +81,140 @@ class CommentIn(BaseModel):
     author: str = Field(min_length=1)
     body: str = Field(min_length=1)
 
+class BulkModerationIn(BaseModel):
+    ids: list[int] = Field(default_factory=list, max_length=BULK_IDS_MAX)
+    from_id: int | None = Field(default=None, ge=1)
+    to_id: int | None = Field(default=None, ge=1)
+
+    @model_validator(mode="after")
+    def ids_or_range(self):
+        if (self.from_id is None) != (self.to_id is None):
+            raise ValueError("from_id and to_id must be given together")
+        if self.from_id is not None and self.from_id > self.to_id:
+            raise ValueError("from_id must not be greater than to_id")
+        if not self.ids and self.from_id is None:
+            raise ValueError("ids or from_id/to_id required")
+        return self
+
+def page(rows, limit: int):
+    # pobieramy limit + 1 wierszy, żeby wiedzieć czy jest kolejna strona
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def before_clause(column: str, before_id: int | None):
+    if before_id is None:
+        return "", ()
+    return f"WHERE {column} < ?", (before_id,)
+
+# --------- Powiadomienia (SSE) ---------
+class Hub:
+    """Pub/sub w procesie: kanał -> kolejki subskrybentów.
+
+    Subskrybent nie trzyma połączenia z bazą, tylko asyncio.Queue. publish()
+    można wołać z wątków puli (endpointy synchroniczne); dostarczenie odbywa
+    się w pętli zdarzeń. Subskrybent z pełnym buforem jest rozłączany
+    (EventSource w przeglądarce sam się połączy ponownie).
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.channels: dict[str, set[asyncio.Queue]] = {}
+
+    def subscribe(self, channel: str):
+        self.loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.channels.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel: str, q: asyncio.Queue):
+        subs = self.channels.get(channel)
+        if subs is not None:
+            subs.discard(q)
+            if not subs:
+                del self.channels[channel]
+
+    def publish(self, channel: str, event: str, data):
+        if self.loop is None or channel not in self.channels:
+            return
+        msg = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        self.loop.call_soon_threadsafe(self._deliver, channel, msg)
+
+    def _deliver(self, channel: str, msg: str):
+        for q in list(self.channels.get(channel, ())):
+            try:
+                q.put_nowait(msg)
+            except asyncio.QueueFull:
+                # zbyt wolny odbiorca - czyścimy bufor i kończymy jego strumień
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+                self.unsubscribe(channel, q)
+
+hub = Hub()
+
+def sse_response(channel: str):
+    q = hub.subscribe(channel)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    msg = await asyncio.wait_for(q.get(), SSE_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if msg is None:
+                    break
+                yield msg
+        finally:
+            hub.unsubscribe(channel, q)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --------- Posty ---------
+# lista zwraca tylko skróty postów; pełna treść przez /api/posts/{id}
 @app.get("/api/posts")
-def list_posts():
+def list_posts(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    before_id: int | None = Query(default=None, ge=1),
+):
+    where, params = before_clause("p.id", before_id)
     conn = get_db()
-    rows = conn.execute("""
-      SELECT id, title, body, created_at
-      FROM posts
-      ORDER BY id DESC
-    """).fetchall()
+    rows = conn.execute(f"""
+      SELECT
+        p.id,
+        p.title,
+        CASE WHEN length(p.body) > ? THEN substr(p.body, 1, ?) || '…' ELSE p.body END AS excerpt,
+        p.created_at,
+        (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id AND c.approved = 1) AS comment_count
+      FROM posts p
+      {where}
+      ORDER BY p.id DESC
+      LIMIT ?
+    """, (EXCERPT_LENGTH, EXCERPT_LENGTH, *params, limit + 1)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return page(rows, limit)
+
+@app.get("/api/posts/{post_id}")
+def get_post(post_id: int):
+    conn = get_db()
+    row = conn.execute("""
+      SELECT
+        p.id, p.title, p.body, p.created_at,
+        (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id AND c.approved = 1) AS comment_count
+      FROM posts p
+      WHERE p.id = ?
+    """, (post_id,)).fetchone()
+    conn.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="post not found")
+    return dict(row)
 
 @app.post("/api/posts", status_code=201)
 def add_post(p: PostIn):
@@ -82,21 +228,76 @@ def add_post(p: PostIn):
     conn.close()
     return {"id": new_id}
 
+# --------- Feed ---------
+# strona postów razem z zatwierdzonymi komentarzami - stała liczba zapytań
+# (posty, komentarze, liczniki) zamiast 1 + N żądań z UI
+@app.get("/api/feed")
+def feed(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    before_id: int | None = Query(default=None, ge=1),
+    comments: int = Query(default=FEED_COMMENTS_DEFAULT, ge=0, le=FEED_COMMENTS_MAX),
+):
+    where, params = before_clause("id", before_id)
+    conn = get_db()
+    rows = conn.execute(f"""
+      SELECT id, title, body, created_at
+      FROM posts
+      {where}
+      ORDER BY id DESC
+      LIMIT ?
+    """, (*params, limit + 1)).fetchall()
+    result = page(rows, limit)
+    posts = result["items"]
+    if not posts:
+        conn.close()
+        return result
+
+    ids = [p["id"] for p in posts]
+    marks = ",".join("?" * len(ids))
+    counts = dict(conn.execute(f"""
+      SELECT post_id, COUNT(*)
+      FROM comments
+      WHERE post_id IN ({marks}) AND approved = 1
+      GROUP BY post_id
+    """, ids).fetchall())
+
+    # ostatnie `comments` zatwierdzonych komentarzy każdego posta, w kolejności dodania
+    by_post = {pid: [] for pid in ids}
+    if comments > 0:
+        crows = conn.execute(f"""
+          SELECT id, post_id, author, body, created_at
+          FROM (
+            SELECT c.*, ROW_NUMBER() OVER (PARTITION BY post_id ORDER BY id DESC) AS rn
+            FROM comments c
+            WHERE post_id IN ({marks}) AND approved = 1
+          )
+          WHERE rn <= ?
+          ORDER BY post_id, id
+        """, (*ids, comments)).fetchall()
+        for c in crows:
+            c = dict(c)
+            by_post[c.pop("post_id")].append(c)
+    conn.close()
+
+    for p in posts:
+        p["comment_count"] = counts.get(p["id"], 0)
+        p["comments"] = by_post[p["id"]]
+    return result
+
 # --------- Komentarze ---------
 @app.get("/api/posts/{post_id}/comments")
 def get_comments(post_id: int):
     conn = get_db()
-    post = conn.execute("SELECT id FROM posts WHERE id = ?", (post_id,)).fetchone()
-    if not post:
-        conn.close()
-        raise HTTPException(status_code=404, detail="post not found")
-
     rows = conn.execute("""
       SELECT id, author, body, created_at
       FROM comments
       WHERE post_id = ? AND approved = 1
       ORDER BY id ASC
     """, (post_id,)).fetchall()
+    # sprawdzenie istnienia posta tylko gdy nie ma komentarzy
+    if not rows and not conn.execute("SELECT id FROM posts WHERE id = ?", (post_id,)).fetchone():
+        conn.close()
+        raise HTTPException(status_code=404, detail="post not found")
     conn.close()
     return [dict(r) for r in rows]
 
@@ -108,51 +309,124 @@ def add_comment(post_id: int, c: CommentIn):
         conn.close()
         raise HTTPException(status_code=404, detail="post not found")
 
-    cur = conn.execute("""
+    row = conn.execute("""
       INSERT INTO comments(post_id, author, body, created_at, approved)
       VALUES(?,?,?,?,0)
+      RETURNING id, post_id, author, body, created_at
     """, (
         post_id,
         c.author.strip(),
         c.body.strip(),
         datetime.now(timezone.utc).isoformat(),
-    ))
+    )).fetchone()
     conn.commit()
-    new_id = cur.lastrowid
     conn.close()
-    return {"id": new_id, "approved": 0}
+    hub.publish("moderation", "pending", dict(row))
+    return {"id": row["id"], "approved": 0}
+
+def post_exists(post_id: int):
+    conn = get_db()
+    row = conn.execute("SELECT id FROM posts WHERE id = ?", (post_id,)).fetchone()
+    conn.close()
+    return row is not None
+
+# nowo zatwierdzone komentarze posta (event: comments, {"comments": [..]})
+@app.get("/api/posts/{post_id}/comments/stream")
+async def comments_stream(post_id: int):
+    if not await run_in_threadpool(post_exists, post_id):
+        raise HTTPException(status_code=404, detail="post not found")
+    return sse_response(f"post:{post_id}")
 
 # --------- Moderacja ---------
 @app.get("/api/moderation/pending")
-def pending_comments():
+def pending_comments(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    after_id: int | None = Query(default=None, ge=0),
+):
+    # kolejka rośnie od najstarszych, więc kursor idzie w górę po id
     conn = get_db()
     rows = conn.execute("""
       SELECT id, post_id, author, body, created_at
       FROM comments
-      WHERE approved = 0
+      WHERE approved = 0 AND id > ?
       ORDER BY id ASC
-    """).fetchall()
+      LIMIT ?
+    """, (after_id or 0, limit + 1)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return page(rows, limit)
+
+# zdarzenia moderacji: pending (nowy komentarz), approved, rejected
+@app.get("/api/moderation/stream")
+async def moderation_stream():
+    return sse_response("moderation")
+
+def publish_approved(rows):
+    # jedno zdarzenie na wywołanie (i na post), a nie na komentarz - masowe
+    # zatwierdzenie nie może przepełnić bufora subskrybenta
+    comments = [dict(r) for r in rows]
+    by_post: dict[int, list] = {}
+    for c in comments:
+        by_post.setdefault(c["post_id"], []).append(c)
+    for post_id, items in by_post.items():
+        hub.publish(f"post:{post_id}", "comments", {"comments": items})
+    if comments:
+        hub.publish("moderation", "approved", {"comments": comments})
 
 @app.post("/api/comments/{comment_id}/approve")
 def approve_comment(comment_id: int):
     conn = get_db()
-    row = conn.execute(
-        "SELECT id, approved FROM comments WHERE id = ?",
-        (comment_id,),
-    ).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="comment not found")
-    if row["approved"] == 1:
+    rows = conn.execute("""
+      UPDATE comments SET approved = 1
+      WHERE id = ? AND approved = 0
+      RETURNING id, post_id, author, body, created_at
+    """, (comment_id,)).fetchall()
+    if not rows:
+        row = conn.execute("SELECT id FROM comments WHERE id = ?", (comment_id,)).fetchone()
         conn.close()
+        if not row:
+            raise HTTPException(status_code=404, detail="comment not found")
         raise HTTPException(status_code=409, detail="already approved")
-
-    conn.execute(
-        "UPDATE comments SET approved = 1 WHERE id = ?",
-        (comment_id,),
-    )
     conn.commit()
     conn.close()
+    publish_approved(rows)
     return {"ok": True}
+
+def bulk_where(req: BulkModerationIn):
+    # lista id przekazywana jako JSON (bez limitu liczby parametrów SQLite)
+    parts, params = [], []
+    if req.ids:
+        parts.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(req.ids))
+    if req.from_id is not None:
+        parts.append("id BETWEEN ? AND ?")
+        params.extend([req.from_id, req.to_id])
+    return " OR ".join(parts), params
+
+@app.post("/api/moderation/approve")
+def bulk_approve(req: BulkModerationIn):
+    where, params = bulk_where(req)
+    conn = get_db()
+    rows = conn.execute(f"""
+      UPDATE comments SET approved = 1
+      WHERE approved = 0 AND ({where})
+      RETURNING id, post_id, author, body, created_at
+    """, params).fetchall()
+    conn.commit()
+    conn.close()
+    publish_approved(rows)
+    return {"affected": len(rows)}
+
+# odrzucenie = usunięcie oczekującego komentarza (zatwierdzonych nie rusza)
+@app.post("/api/moderation/reject")
+def bulk_reject(req: BulkModerationIn):
+    where, params = bulk_where(req)
+    conn = get_db()
+    rows = conn.execute(
+        f"DELETE FROM comments WHERE approved = 0 AND ({where}) RETURNING id",
+        params,
+    ).fetchall()
+    conn.commit()
+    conn.close()
+    if rows:
+        hub.publish("moderation", "rejected", {"ids": [r["id"] for r in rows]})
+    return {"affected": len(rows)}
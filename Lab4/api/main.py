@@ -1,11 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
+from datetime import datetime, timezone
+from bisect import bisect_left
+from itertools import accumulate
+import heapq
+import json
+import math
+import queue
 import sqlite3
+import threading
+import time
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/movies.db")
 
+# tryb write-behind dla ocen: kolejka w pamięci + zapis paczkami w tle
+RATING_WRITE_BEHIND = os.environ.get("RATING_WRITE_BEHIND", "0") == "1"
+RATING_QUEUE_SIZE = int(os.environ.get("RATING_QUEUE_SIZE", "10000"))
+RATING_FLUSH_MS = int(os.environ.get("RATING_FLUSH_MS", "50"))
+RATING_FLUSH_MAX = int(os.environ.get("RATING_FLUSH_MAX", "1000"))
+RATING_RETRY_TOTAL_S = float(os.environ.get("RATING_RETRY_TOTAL_S", "60"))
+
+# ranking bayesowski: waga średniej globalnej (w głosach) i maksymalna nieaktualność cache
+LEADERBOARD_PRIOR_VOTES = int(os.environ.get("LEADERBOARD_PRIOR_VOTES", "10"))
+LEADERBOARD_STALENESS = float(os.environ.get("LEADERBOARD_STALENESS", "2"))
+LEADERBOARD_FULL_RELOAD = float(os.environ.get("LEADERBOARD_FULL_RELOAD", "300"))
+
+# histogram ocen: kolumny score_1 .. score_5 w movies
+SCORES = (1, 2, 3, 4, 5)
+STATS_IDS_MAX = 500
+
 app = FastAPI()
 
 app.add_middleware(
@@ -28,7 +53,17 @@ def init_db():
     CREATE TABLE IF NOT EXISTS movies (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       title TEXT NOT NULL,
-      year INTEGER NOT NULL
+      year INTEGER NOT NULL,
+      rating_sum INTEGER NOT NULL DEFAULT 0,
+      rating_count INTEGER NOT NULL DEFAULT 0,
+      avg_score REAL GENERATED ALWAYS AS (
+        ROUND(CASE WHEN rating_count > 0 THEN 1.0 * rating_sum / rating_count ELSE 0 END, 2)
+      ) VIRTUAL,
+      score_1 INTEGER NOT NULL DEFAULT 0,
+      score_2 INTEGER NOT NULL DEFAULT 0,
+      score_3 INTEGER NOT NULL DEFAULT 0,
+      score_4 INTEGER NOT NULL DEFAULT 0,
+      score_5 INTEGER NOT NULL DEFAULT 0
     );
 
     CREATE TABLE IF NOT EXISTS ratings (
@@ -36,13 +71,337 @@ def init_db():
       movie_id INTEGER NOT NULL REFERENCES movies(id) ON DELETE CASCADE,
       score INTEGER NOT NULL CHECK (score BETWEEN 1 AND 5)
     );
+
+    -- indeks musi istnieć przed przeliczeniem agregatów w ensure_rating_columns
+    CREATE INDEX IF NOT EXISTS idx_ratings_movie ON ratings(movie_id);
+    """)
+    ensure_rating_columns(conn)
+    conn.executescript("""
+    -- ranking to przejście po indeksie zamiast agregacji ratings
+    CREATE INDEX IF NOT EXISTS idx_movies_rank
+      ON movies(avg_score DESC, rating_count DESC, id DESC);
+
+    -- agregaty ocen w movies (suma, liczba, histogram), aktualizowane w tej samej
+    -- transakcji co ratings; (x = n) daje 0/1, więc zmienia się tylko jeden kubełek
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_insert AFTER INSERT ON ratings
+    BEGIN
+      UPDATE movies
+      SET rating_sum = rating_sum + NEW.score, rating_count = rating_count + 1,
+          score_1 = score_1 + (NEW.score = 1), score_2 = score_2 + (NEW.score = 2),
+          score_3 = score_3 + (NEW.score = 3), score_4 = score_4 + (NEW.score = 4),
+          score_5 = score_5 + (NEW.score = 5)
+      WHERE id = NEW.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_update AFTER UPDATE OF movie_id, score ON ratings
+    BEGIN
+      UPDATE movies
+      SET rating_sum = rating_sum - OLD.score, rating_count = rating_count - 1,
+          score_1 = score_1 - (OLD.score = 1), score_2 = score_2 - (OLD.score = 2),
+          score_3 = score_3 - (OLD.score = 3), score_4 = score_4 - (OLD.score = 4),
+          score_5 = score_5 - (OLD.score = 5)
+      WHERE id = OLD.movie_id;
+      UPDATE movies
+      SET rating_sum = rating_sum + NEW.score, rating_count = rating_count + 1,
+          score_1 = score_1 + (NEW.score = 1), score_2 = score_2 + (NEW.score = 2),
+          score_3 = score_3 + (NEW.score = 3), score_4 = score_4 + (NEW.score = 4),
+          score_5 = score_5 + (NEW.score = 5)
+      WHERE id = NEW.movie_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_ratings_delete AFTER DELETE ON ratings
+    BEGIN
+      UPDATE movies
+      SET rating_sum = rating_sum - OLD.score, rating_count = rating_count - 1,
+          score_1 = score_1 - (OLD.score = 1), score_2 = score_2 - (OLD.score = 2),
+          score_3 = score_3 - (OLD.score = 3), score_4 = score_4 - (OLD.score = 4),
+          score_5 = score_5 - (OLD.score = 5)
+      WHERE id = OLD.movie_id;
+    END;
     """)
     conn.commit()
     conn.close()
 
+# --------- Agregaty ocen ---------
+def ensure_rating_columns(conn: sqlite3.Connection):
+    # starsze bazy nie mają kolumn z agregatami - dodajemy je i przeliczamy
+    cols = {r["name"] for r in conn.execute("PRAGMA table_xinfo(movies)")}
+    added = False
+    if "rating_sum" not in cols:
+        conn.execute("ALTER TABLE movies ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE movies ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute("""
+          ALTER TABLE movies ADD COLUMN avg_score REAL GENERATED ALWAYS AS (
+            ROUND(CASE WHEN rating_count > 0 THEN 1.0 * rating_sum / rating_count ELSE 0 END, 2)
+          ) VIRTUAL
+        """)
+        added = True
+    if "score_1" not in cols:
+        for s in SCORES:
+            conn.execute(f"ALTER TABLE movies ADD COLUMN score_{s} INTEGER NOT NULL DEFAULT 0")
+        # stare triggery nie znają kubełków - init_db utworzy je na nowo
+        for name in ("trg_ratings_insert", "trg_ratings_update", "trg_ratings_delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        added = True
+    if added:
+        rebuild_rating_aggregates(conn)
+
+def rebuild_rating_aggregates(conn: sqlite3.Connection):
+    # jedno przejście po ratings (GROUP BY) zamiast podzapytań skorelowanych per film;
+    # filmy bez ocen są zerowane osobno
+    buckets = ", ".join(f"SUM(score = {s}) AS s{s}" for s in SCORES)
+    zero = ", ".join(f"score_{s} = 0" for s in SCORES)
+    copy = ", ".join(f"score_{s} = agg.s{s}" for s in SCORES)
+    reset = conn.execute(f"""
+      UPDATE movies
+      SET rating_sum = 0, rating_count = 0, {zero}
+      WHERE NOT EXISTS (SELECT 1 FROM ratings WHERE movie_id = movies.id)
+    """)
+    cur = conn.execute(f"""
+      UPDATE movies
+      SET rating_sum = agg.total, rating_count = agg.votes,
+          {copy}
+      FROM (
+        SELECT movie_id, SUM(score) AS total, COUNT(*) AS votes, {buckets}
+        FROM ratings
+        GROUP BY movie_id
+      ) AS agg
+      WHERE movies.id = agg.movie_id
+    """)
+    return reset.rowcount + cur.rowcount
+
+def histogram_stats(hist):
+    # statystyki liczone z 5 kubełków zamiast z wierszy ratings: koszt nie zależy od liczby ocen
+    total = sum(hist)
+    if total == 0:
+        return {"votes": 0, "histogram": list(hist), "mean": None, "stddev": None, "percentiles": None}
+    mean = sum(s * n for s, n in zip(SCORES, hist)) / total
+    var = sum(s * s * n for s, n in zip(SCORES, hist)) / total - mean * mean
+    cumulative = list(accumulate(hist))
+    # percentyl metodą nearest-rank: najmniejsza ocena, której skumulowana liczność >= p% głosów
+    percentiles = {
+        f"p{p}": SCORES[bisect_left(cumulative, math.ceil(p / 100 * total))]
+        for p in (10, 25, 50, 75, 90)
+    }
+    return {
+        "votes": total,
+        "histogram": list(hist),
+        "mean": round(mean, 4),
+        "stddev": round(math.sqrt(max(var, 0.0)), 4),
+        "percentiles": percentiles,
+    }
+
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if RATING_WRITE_BEHIND:
+        start_rating_writer()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_rating_writer()
+
+# --------- Zapis ocen w tle (write-behind) ---------
+rating_queue: queue.Queue = queue.Queue(maxsize=RATING_QUEUE_SIZE)
+rating_writer_stop = threading.Event()
+rating_writer = {"thread": None, "written": 0, "failed": 0, "batches": 0, "retries": 0}
+known_movies: set[int] = set()
+
+def flush_ratings(batch):
+    # jedna transakcja (jeden fsync) na paczkę; oceny filmów usuniętych w międzyczasie są pomijane
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+    except Exception:
+        conn.close()
+        raise
+    try:
+        cur = conn.executemany("""
+          INSERT INTO ratings(movie_id, score)
+          SELECT ?, ? WHERE EXISTS (SELECT 1 FROM movies WHERE id = ?)
+        """, [(movie_id, score, movie_id) for movie_id, score in batch])
+        conn.commit()
+        mark_rated(movie_id for movie_id, _ in batch)
+        return cur.rowcount
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+    finally:
+        conn.close()
+
+def rating_writer_loop():
+    # paczka zamykana po RATING_FLUSH_MAX ocenach albo RATING_FLUSH_MS od pierwszej;
+    # po sygnale stopu kolejka jest opróżniana do końca
+    while True:
+        try:
+            batch = [rating_queue.get(timeout=0.2)]
+        except queue.Empty:
+            if rating_writer_stop.is_set():
+                return
+            continue
+
+        deadline = time.monotonic() + RATING_FLUSH_MS / 1000
+        while len(batch) < RATING_FLUSH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(rating_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        flush_with_retry(batch)
+
+def is_busy(e: sqlite3.Error):
+    # kod rozszerzony (np. SQLITE_BUSY_SNAPSHOT) ma kod główny w dolnym bajcie
+    code = getattr(e, "sqlite_errorcode", None)
+    return code is not None and (code & 0xFF) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+def flush_with_retry(batch):
+    # oceny z paczki dostały już 202, więc zajętą bazę (np. gdy blokadę trzyma
+    # rebuild-ratings) przeczekujemy z rosnącym odstępem, najdłużej RATING_RETRY_TOTAL_S;
+    # w tym czasie kolejka się zapełnia i API odpowiada 429. Inne błędy, przekroczony
+    # limit czasu albo sygnał stopu kończą próby - paczka trafia do "failed".
+    deadline = time.monotonic() + RATING_RETRY_TOTAL_S
+    delay = 0.1
+    while True:
+        try:
+            rating_writer["written"] += flush_ratings(batch)
+            rating_writer["batches"] += 1
+            return
+        except sqlite3.Error as e:
+            retry = is_busy(e) and time.monotonic() + delay < deadline
+            if retry and not rating_writer_stop.wait(delay):
+                rating_writer["retries"] += 1
+                delay = min(delay * 2, 2.0)
+                continue
+            rating_writer["failed"] += len(batch)
+            print(f"rating flush failed ({len(batch)} votes): {e}")
+            return
+
+def start_rating_writer():
+    if rating_writer["thread"] is not None:
+        return
+    rating_writer_stop.clear()
+    t = threading.Thread(target=rating_writer_loop, name="rating-writer", daemon=True)
+    rating_writer["thread"] = t
+    t.start()
+
+def stop_rating_writer(timeout: float = 30):
+    t = rating_writer["thread"]
+    if t is None:
+        return
+    rating_writer_stop.set()
+    t.join(timeout)
+    rating_writer["thread"] = None
+
+def movie_exists(movie_id: int):
+    if movie_id in known_movies:
+        return True
+    conn = get_db()
+    row = conn.execute("SELECT id FROM movies WHERE id = ?", (movie_id,)).fetchone()
+    conn.close()
+    if row:
+        known_movies.add(movie_id)
+    return row is not None
+
+# --------- Ranking (top-N) ---------
+# Agregaty filmów trzymane w pamięci; zapisy ocen oznaczają filmy jako "brudne",
+# a przy odczycie (nie częściej niż co LEADERBOARD_STALENESS s) dociągane są
+# z bazy tylko te filmy. Pełne przeładowanie co LEADERBOARD_FULL_RELOAD s
+# łapie zmiany spoza tego procesu.
+leaderboard_lock = threading.Lock()
+leaderboard = {
+    "movies": {},        # id -> (title, year, rating_sum, rating_count)
+    "dirty": set(),
+    "full_at": None,
+    "refreshed_at": 0.0,
+    "as_of": None,
+    "ranked": {},        # min_votes -> lista posortowana po wyniku
+}
+
+def mark_rated(movie_ids):
+    with leaderboard_lock:
+        leaderboard["dirty"].update(movie_ids)
+
+def refresh_leaderboard():
+    now = time.monotonic()
+    full = leaderboard["full_at"] is None or now - leaderboard["full_at"] >= LEADERBOARD_FULL_RELOAD
+    if not full and (not leaderboard["dirty"] or now - leaderboard["refreshed_at"] < LEADERBOARD_STALENESS):
+        return
+
+    dirty = leaderboard["dirty"]
+    leaderboard["dirty"] = set()
+    conn = get_db()
+    if full:
+        rows = conn.execute("SELECT id, title, year, rating_sum, rating_count FROM movies").fetchall()
+        leaderboard["movies"] = {}
+        leaderboard["full_at"] = now
+    else:
+        ids = sorted(dirty)
+        rows = conn.execute(f"""
+          SELECT id, title, year, rating_sum, rating_count
+          FROM movies
+          WHERE id IN ({",".join("?" * len(ids))})
+        """, ids).fetchall()
+    conn.close()
+
+    for r in rows:
+        leaderboard["movies"][r["id"]] = (r["title"], r["year"], r["rating_sum"], r["rating_count"])
+    leaderboard["refreshed_at"] = now
+    leaderboard["as_of"] = datetime.now(timezone.utc).isoformat()
+    leaderboard["ranked"] = {}
+
+def rank_movies(min_votes: int):
+    movies = leaderboard["movies"]
+    total_sum = sum(m[2] for m in movies.values())
+    total_count = sum(m[3] for m in movies.values())
+    mean = total_sum / total_count if total_count else 0.0
+    prior = LEADERBOARD_PRIOR_VOTES
+
+    ranked = []
+    for movie_id, (title, year, rating_sum, rating_count) in movies.items():
+        if rating_count < min_votes or rating_count == 0:
+            continue
+        # średnia ważona: (v * R + m * C) / (v + m)
+        score = (rating_sum + prior * mean) / (rating_count + prior)
+        ranked.append((score, rating_count, movie_id, title, year, rating_sum / rating_count))
+    return mean, ranked
+
+@app.get("/api/movies/top")
+def top_movies(
+    n: int = Query(default=10, ge=1, le=100),
+    min_votes: int = Query(default=1, ge=1, le=1_000_000),
+):
+    with leaderboard_lock:
+        refresh_leaderboard()
+        cached = leaderboard["ranked"].get(min_votes)
+        if cached is None:
+            mean, ranked = rank_movies(min_votes)
+            cached = (mean, heapq.nlargest(100, ranked))
+            if len(leaderboard["ranked"]) > 32:
+                leaderboard["ranked"] = {}
+            leaderboard["ranked"][min_votes] = cached
+        mean, top = cached
+        as_of = leaderboard["as_of"]
+
+    return {
+        "items": [
+            {
+                "id": movie_id,
+                "title": title,
+                "year": year,
+                "avg_score": round(avg, 2),
+                "votes": votes,
+                "score": round(score, 4),
+            }
+            for score, votes, movie_id, title, year, avg in top[:n]
+        ],
+        "mean": round(mean, 4),
+        "prior_votes": LEADERBOARD_PRIOR_VOTES,
+        "as_of": as_of,
+        "max_staleness": LEADERBOARD_STALENESS,
+    }
 
 class MovieIn(BaseModel):
     title: str = Field(min_length=1)
@@ -56,20 +415,67 @@ class RatingIn(BaseModel):
 def list_movies():
     conn = get_db()
     rows = conn.execute("""
-      SELECT
-        m.id,
-        m.title,
-        m.year,
-        ROUND(COALESCE(AVG(r.score), 0), 2) AS avg_score,
-        COUNT(r.id) AS votes
-      FROM movies m
-      LEFT JOIN ratings r ON r.movie_id = m.id
-      GROUP BY m.id
-      ORDER BY avg_score DESC, votes DESC, m.id DESC
+      SELECT id, title, year, avg_score, rating_count AS votes
+      FROM movies
+      ORDER BY avg_score DESC, rating_count DESC, id DESC
     """).fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+HISTOGRAM_COLUMNS = ", ".join(f"score_{s}" for s in SCORES)
+
+def movie_stats(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        **histogram_stats([row[f"score_{s}"] for s in SCORES]),
+    }
+
+@app.get("/api/movies/stats")
+def movies_stats(ids: str = Query(..., description="lista id filmów, np. 1,2,3")):
+    try:
+        id_list = sorted({int(x) for x in ids.split(",") if x.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if not id_list:
+        raise HTTPException(status_code=400, detail="ids is empty")
+    if len(id_list) > STATS_IDS_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {STATS_IDS_MAX} ids per request")
+
+    conn = get_db()
+    rows = conn.execute(f"""
+      SELECT id, title, {HISTOGRAM_COLUMNS}
+      FROM movies
+      WHERE id IN (SELECT value FROM json_each(?))
+      ORDER BY id
+    """, (json.dumps(id_list),)).fetchall()
+    conn.close()
+    return [movie_stats(r) for r in rows]
+
+@app.get("/api/movies/{movie_id}/stats")
+def get_movie_stats(movie_id: int):
+    conn = get_db()
+    row = conn.execute(
+        f"SELECT id, title, {HISTOGRAM_COLUMNS} FROM movies WHERE id = ?",
+        (movie_id,),
+    ).fetchone()
+    conn.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="movie not found")
+    return movie_stats(row)
+
+@app.get("/api/stats")
+def catalog_stats():
+    # histogram katalogu to suma kubełków filmów - jeden skan movies, bez czytania ratings
+    conn = get_db()
+    row = conn.execute(
+        "SELECT COUNT(*) AS movies, "
+        + ", ".join(f"COALESCE(SUM(score_{s}), 0) AS score_{s}" for s in SCORES)
+        + " FROM movies"
+    ).fetchone()
+    conn.close()
+    return {"movies": row["movies"], **histogram_stats([row[f"score_{s}"] for s in SCORES])}
+
 @app.post("/api/movies", status_code=201)
 def add_movie(m: MovieIn):
     conn = get_db()
@@ -80,10 +486,26 @@ def add_movie(m: MovieIn):
     conn.commit()
     new_id = cur.lastrowid
     conn.close()
+    mark_rated([new_id])
     return {"id": new_id}
 
 @app.post("/api/ratings", status_code=201)
-def add_rating(r: RatingIn):
+def add_rating(r: RatingIn, response: Response):
+    if rating_writer["thread"] is not None:
+        # write-behind: 202 po przyjęciu do kolejki, 429 gdy kolejka pełna
+        if not movie_exists(r.movie_id):
+            raise HTTPException(status_code=404, detail="movie not found")
+        try:
+            rating_queue.put_nowait((r.movie_id, r.score))
+        except queue.Full:
+            raise HTTPException(
+                status_code=429,
+                detail="rating queue full",
+                headers={"Retry-After": "1"},
+            )
+        response.status_code = 202
+        return {"ok": True, "queued": True}
+
     conn = get_db()
     movie = conn.execute("SELECT id FROM movies WHERE id = ?", (r.movie_id,)).fetchone()
     if not movie:
@@ -96,4 +518,35 @@ def add_rating(r: RatingIn):
     )
     conn.commit()
     conn.close()
+    mark_rated([r.movie_id])
     return {"ok": True}
+
+@app.get("/api/ratings/ingest")
+def ingest_status():
+    return {
+        "write_behind": rating_writer["thread"] is not None,
+        "queued": rating_queue.qsize(),
+        "capacity": RATING_QUEUE_SIZE,
+        "written": rating_writer["written"],
+        "failed": rating_writer["failed"],
+        "batches": rating_writer["batches"],
+        "retries": rating_writer["retries"],
+    }
+
+# --------- CLI (utrzymanie bazy) ---------
+# docker compose exec api python main.py rebuild-ratings
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lab4 - narzędzia bazy danych")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild-ratings", help="przelicz rating_sum / rating_count / score_1..5 z tabeli ratings")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db()
+    if args.cmd == "rebuild-ratings":
+        n = rebuild_rating_aggregates(conn)
+        conn.commit()
+        print(f"rebuilt rating aggregates for {n} movie(s)")
+    conn.close()
@@ -0,0 +1,92 @@
+"""Benchmark zapisu ocen: commit per głos vs write-behind.
+
+`direct` - każde wywołanie add_rating() to osobna transakcja (fsync na głos).
+`write-behind` - add_rating() odkłada głos do kolejki, a wątek w tle zapisuje
+paczki (RATING_FLUSH_MS / RATING_FLUSH_MAX). Dla write-behind raportowane są
+dwie liczby: przyjęcia (do 202) i trwały zapis (do opróżnienia kolejki).
+Odpowiedzi 429 są ponawiane po krótkiej przerwie i zliczane.
+
+Uruchomienie (z katalogu Lab4):
+    python bench/bench_ratings.py --votes 20000 --threads 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--votes", type=int, default=20000, help="liczba głosów na wariant")
+    parser.add_argument("--threads", type=int, default=16, help="liczba równoległych klientów")
+    parser.add_argument("--movies", type=int, default=100, help="liczba filmów")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DB_PATH"] = os.path.join(tmp.name, "movies.db")
+    sys.path.insert(0, API_DIR)
+    import main as api
+    from fastapi import HTTPException, Response
+
+    api.init_db()
+    conn = api.get_db()
+    conn.executemany(
+        "INSERT INTO movies(title, year) VALUES(?, ?)",
+        [(f"movie {i}", 2000 + i % 25) for i in range(args.movies)],
+    )
+    conn.commit()
+    conn.close()
+
+    def count_ratings():
+        c = api.get_db()
+        n = c.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+        c.close()
+        return n
+
+    def run(label, write_behind):
+        if write_behind:
+            api.start_rating_writer()
+        before = count_ratings()
+        retries = 0
+
+        def vote(i):
+            nonlocal retries
+            req = api.RatingIn(movie_id=1 + i % args.movies, score=1 + i % 5)
+            while True:
+                try:
+                    api.add_rating(req, Response())
+                    return
+                except HTTPException as e:
+                    if e.status_code != 429:
+                        raise
+                    retries += 1
+                    time.sleep(0.005)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(vote, range(args.votes)))
+        accepted = time.perf_counter() - t0
+        if write_behind:
+            api.stop_rating_writer()
+        durable = time.perf_counter() - t0
+        written = count_ratings() - before
+
+        line = f"{label:<13} accepted {args.votes / accepted:>9.0f} votes/s   durable {written / durable:>9.0f} votes/s"
+        if write_behind:
+            line += f"   batches={api.rating_writer['batches']} 429-retries={retries}"
+        print(line)
+        return written
+
+    print(f"votes={args.votes} threads={args.threads} flush={api.RATING_FLUSH_MS}ms/{api.RATING_FLUSH_MAX} queue={api.RATING_QUEUE_SIZE}")
+    ok = run("direct", False) == args.votes
+    ok = run("write-behind", True) == args.votes and ok
+    tmp.cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
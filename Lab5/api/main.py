@@ -1,11 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
+import asyncio
+import json
 import sqlite3
+import threading
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/kanban.db")
 
+# tablica obsługiwana przez starsze ścieżki /api/board i /api/board/ws
+DEFAULT_BOARD_ID = 1
+DEFAULT_COLUMNS = ("Todo", "Doing", "Done")
+
+PAGE_LIMIT_DEFAULT = 50
+PAGE_LIMIT_MAX = 500
+
+# klucze kolejności: po przekroczeniu tej długości kolumna jest przenumerowywana w tle
+RANK_MAX_LEN = int(os.environ.get("RANK_MAX_LEN", "16"))
+RANK_REBALANCE_INTERVAL = float(os.environ.get("RANK_REBALANCE_INTERVAL", "60"))
+
+# ile najnowszych tombstone'ów (usuniętych zadań) trzymać dla synchronizacji przyrostowej
+TOMBSTONE_KEEP = int(os.environ.get("TOMBSTONE_KEEP", "10000"))
+
+# WebSocket: bufor zdarzeń na klienta i limit czasu pojedynczego wysłania
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10"))
+
 app = FastAPI()
 
 app.add_middleware(
@@ -26,116 +48,641 @@ def init_db():
     conn = get_db()
 
     conn.executescript("""
+    -- rev: rewizja tablicy, rośnie przy każdej zmianie jej zadań;
+    -- pruned_rev: najwyższa rewizja usuniętych już tombstone'ów
+    CREATE TABLE IF NOT EXISTS boards (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      rev INTEGER NOT NULL DEFAULT 0,
+      pruned_rev INTEGER NOT NULL DEFAULT 0
+    );
+
     CREATE TABLE IF NOT EXISTS columns (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
+      board_id INTEGER NOT NULL REFERENCES boards(id),
       name TEXT NOT NULL,
       ord INTEGER NOT NULL
     );
 
+    -- board_id powielone z kolumny: zadania tablicy czytamy bez złączenia z columns
     CREATE TABLE IF NOT EXISTS tasks (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       title TEXT NOT NULL,
+      board_id INTEGER NOT NULL REFERENCES boards(id),
       col_id INTEGER NOT NULL REFERENCES columns(id),
-      ord INTEGER NOT NULL
+      rank TEXT NOT NULL,
+      rev INTEGER NOT NULL DEFAULT 0
     );
+
+    CREATE TABLE IF NOT EXISTS task_tombstones (
+      task_id INTEGER PRIMARY KEY,
+      board_id INTEGER NOT NULL,
+      rev INTEGER NOT NULL
+    );
+    """)
+    ensure_rank_column(conn)
+    ensure_rev_column(conn)
+    ensure_board_columns(conn)
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_columns_board ON columns(board_id, ord);
+
+    -- zadania tablicy w kolejności, sąsiedzi przy przenoszeniu i ostatnie zadanie
+    -- w kolumnie - wszystko jako zakres jednej tablicy
+    CREATE INDEX IF NOT EXISTS idx_tasks_board_col_rank ON tasks(board_id, col_id, rank);
+
+    -- zmiany tablicy od rewizji X: /api/boards/{id}?since=X
+    CREATE INDEX IF NOT EXISTS idx_tasks_board_rev ON tasks(board_id, rev);
+    CREATE INDEX IF NOT EXISTS idx_task_tombstones_board_rev ON task_tombstones(board_id, rev);
+
+    -- każda zmiana zadania dostaje kolejną rewizję swojej tablicy w tej samej transakcji;
+    -- trigger UPDATE nie obejmuje kolumny rev, więc nie wywołuje sam siebie
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_rev_insert AFTER INSERT ON tasks
+    BEGIN
+      UPDATE boards SET rev = rev + 1 WHERE id = NEW.board_id;
+      UPDATE tasks SET rev = (SELECT rev FROM boards WHERE id = NEW.board_id) WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_rev_update AFTER UPDATE OF title, col_id, rank ON tasks
+    BEGIN
+      UPDATE boards SET rev = rev + 1 WHERE id = NEW.board_id;
+      UPDATE tasks SET rev = (SELECT rev FROM boards WHERE id = NEW.board_id) WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_tasks_rev_delete AFTER DELETE ON tasks
+    BEGIN
+      UPDATE boards SET rev = rev + 1 WHERE id = OLD.board_id;
+      INSERT OR REPLACE INTO task_tombstones(task_id, board_id, rev)
+      VALUES (OLD.id, OLD.board_id, (SELECT rev FROM boards WHERE id = OLD.board_id));
+    END;
     """)
 
-    # Predefiniowane kolumny
-    existing = conn.execute("SELECT COUNT(*) AS c FROM columns").fetchone()["c"]
+    # Predefiniowana tablica
+    existing = conn.execute("SELECT COUNT(*) AS c FROM boards").fetchone()["c"]
     if existing == 0:
+        create_board(conn, "Kanban")
+
+    conn.commit()
+    conn.close()
+
+def create_board(conn: sqlite3.Connection, name: str) -> int:
+    board_id = conn.execute("INSERT INTO boards(name) VALUES(?)", (name,)).lastrowid
+    conn.executemany(
+        "INSERT INTO columns(board_id, name, ord) VALUES(?,?,?)",
+        [(board_id, col, i) for i, col in enumerate(DEFAULT_COLUMNS, start=1)],
+    )
+    return board_id
+
+def has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+def ensure_board_columns(conn: sqlite3.Connection):
+    # starsze bazy mają jedną globalną tablicę - jej kolumny i zadania trafiają do tablicy 1
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(columns)")}
+    if "board_id" in cols:
+        return
+    conn.execute("INSERT OR IGNORE INTO boards(id, name) VALUES (?, 'Kanban')", (DEFAULT_BOARD_ID,))
+    if has_table(conn, "board_rev"):
+        conn.execute("""
+          UPDATE boards
+          SET rev = (SELECT rev FROM board_rev), pruned_rev = (SELECT pruned_rev FROM board_rev)
+          WHERE id = ?
+        """, (DEFAULT_BOARD_ID,))
+        conn.execute("DROP TABLE board_rev")
+    # ADD COLUMN z REFERENCES wymaga DEFAULT NULL, więc w migrowanych bazach bez klucza obcego
+    conn.execute(f"ALTER TABLE columns ADD COLUMN board_id INTEGER NOT NULL DEFAULT {DEFAULT_BOARD_ID}")
+    conn.execute(f"ALTER TABLE tasks ADD COLUMN board_id INTEGER NOT NULL DEFAULT {DEFAULT_BOARD_ID}")
+    tombstone_cols = {r["name"] for r in conn.execute("PRAGMA table_info(task_tombstones)")}
+    if "board_id" not in tombstone_cols:
+        conn.execute(f"ALTER TABLE task_tombstones ADD COLUMN board_id INTEGER NOT NULL DEFAULT {DEFAULT_BOARD_ID}")
+    # indeksy i triggery jednej tablicy - init_db tworzy wersje z board_id
+    for name in ("trg_tasks_rev_insert", "trg_tasks_rev_update", "trg_tasks_rev_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name in ("idx_tasks_col_rank", "idx_tasks_rev", "idx_task_tombstones_rev"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+def page(rows, limit: int):
+    # pobieramy limit + 1 wierszy, żeby wiedzieć czy jest kolejna strona
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+# --------- Klucze kolejności (rank) ---------
+# Kolejność zadań w kolumnie wyznacza tekstowy klucz porównywany leksykograficznie.
+# Nowy klucz zawsze da się wstawić między dwa istniejące, więc przeniesienie zadania
+# zmienia jeden wiersz. Klucze nie kończą się cyfrą "0" - inaczej zabrakłoby miejsca
+# przed nimi.
+RANK_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+def rank_between(lo: str | None, hi: str | None) -> str:
+    """Klucz ściśle pomiędzy lo i hi (None = brak ograniczenia z danej strony)."""
+    if hi is None and lo:
+        # dopisanie na koniec: zwiększamy pierwszą cyfrę, którą da się zwiększyć,
+        # żeby klucze rosły o jeden znak co ~60 zadań, a nie co kilka (jak przy połowieniu)
+        for i, ch in enumerate(lo):
+            if ch != RANK_DIGITS[-1]:
+                return lo[:i] + RANK_DIGITS[RANK_DIGITS.index(ch) + 1]
+        return lo + RANK_DIGITS[1]
+    if lo is None and hi:
+        # dopisanie na początek: symetrycznie zmniejszamy pierwszą cyfrę większą od "1"
+        for i, ch in enumerate(hi):
+            d = RANK_DIGITS.index(ch)
+            if d > 1:
+                return hi[:i] + RANK_DIGITS[d - 1]
+        # same "0" i "1": pierwszą "1" zamieniamy na "0" i dopisujemy największą cyfrę
+        i = hi.index(RANK_DIGITS[1])
+        return hi[:i] + RANK_DIGITS[0] + RANK_DIGITS[-1]
+    return rank_midpoint(lo or "", hi)
+
+def rank_midpoint(lo: str, hi: str | None) -> str:
+    if hi is not None:
+        # wspólny prefiks (lo dopełnione zerami) przechodzi bez zmian
+        n = 0
+        while n < len(hi) and (lo[n] if n < len(lo) else RANK_DIGITS[0]) == hi[n]:
+            n += 1
+        if n > 0:
+            return hi[:n] + rank_midpoint(lo[n:], hi[n:])
+
+    d_lo = RANK_DIGITS.index(lo[0]) if lo else 0
+    d_hi = RANK_DIGITS.index(hi[0]) if hi is not None else len(RANK_DIGITS)
+    if d_hi - d_lo > 1:
+        return RANK_DIGITS[(d_lo + d_hi) // 2]
+    # sąsiednie cyfry: zostajemy przy cyfrze lo i szukamy miejsca głębiej
+    if hi is not None and len(hi) > 1:
+        return hi[:1]
+    return RANK_DIGITS[d_lo] + rank_midpoint(lo[1:], None)
+
+def spread_ranks(n: int) -> list[str]:
+    """n równo rozłożonych, możliwie krótkich kluczy (przenumerowanie kolumny)."""
+    base = len(RANK_DIGITS)
+    width = 1
+    while base ** width <= n:
+        width += 1
+    ranks = []
+    for i in range(1, n + 1):
+        v = i * base ** width // (n + 1)
+        digits = []
+        for _ in range(width):
+            v, d = divmod(v, base)
+            digits.append(RANK_DIGITS[d])
+        ranks.append("".join(reversed(digits)).rstrip(RANK_DIGITS[0]))
+    return ranks
+
+def rebalance_column(conn: sqlite3.Connection, board_id: int, col_id: int) -> int:
+    ids = [r["id"] for r in conn.execute(
+        "SELECT id FROM tasks WHERE board_id = ? AND col_id = ? ORDER BY rank, id",
+        (board_id, col_id),
+    )]
+    conn.executemany(
+        "UPDATE tasks SET rank = ? WHERE id = ?",
+        zip(spread_ranks(len(ids)), ids),
+    )
+    return len(ids)
+
+def ensure_rank_column(conn: sqlite3.Connection):
+    # starsze bazy trzymają pozycję w tasks.ord - zamieniamy ją na klucze rank
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(tasks)")}
+    if "rank" in cols:
+        return
+    conn.execute("ALTER TABLE tasks ADD COLUMN rank TEXT NOT NULL DEFAULT ''")
+    for (col_id,) in conn.execute("SELECT DISTINCT col_id FROM tasks").fetchall():
+        ids = [r["id"] for r in conn.execute(
+            "SELECT id FROM tasks WHERE col_id = ? ORDER BY ord, id", (col_id,)
+        )]
         conn.executemany(
-            "INSERT INTO columns(name, ord) VALUES(?,?)",
-            [("Todo", 1), ("Doing", 2), ("Done", 3)],
+            "UPDATE tasks SET rank = ? WHERE id = ?",
+            zip(spread_ranks(len(ids)), ids),
         )
+    conn.execute("ALTER TABLE tasks DROP COLUMN ord")
 
-    conn.commit()
+def ensure_rev_column(conn: sqlite3.Connection):
+    # starsze bazy: zadania bez rewizji dostają 0 - klienci i tak zaczynają od pełnej tablicy
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(tasks)")}
+    if "rev" not in cols:
+        conn.execute("ALTER TABLE tasks ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+
+def prune_tombstones(conn: sqlite3.Connection, keep: int) -> int:
+    # keep najnowszych tombstone'ów na tablicę; klient z since < pruned_rev mógł
+    # przegapić usunięcie - dostanie pełną tablicę
+    boards = [r["board_id"] for r in conn.execute("""
+      SELECT board_id FROM task_tombstones GROUP BY board_id HAVING COUNT(*) > ?
+    """, (keep,))]
+    pruned = 0
+    for board_id in boards:
+        row = conn.execute("""
+          SELECT rev FROM task_tombstones WHERE board_id = ?
+          ORDER BY rev DESC LIMIT 1 OFFSET ?
+        """, (board_id, keep)).fetchone()
+        cur = conn.execute(
+            "DELETE FROM task_tombstones WHERE board_id = ? AND rev <= ?", (board_id, row["rev"])
+        )
+        conn.execute(
+            "UPDATE boards SET pruned_rev = MAX(pruned_rev, ?) WHERE id = ?", (row["rev"], board_id)
+        )
+        pruned += cur.rowcount
+    return pruned
+
+def current_rev(conn: sqlite3.Connection, board_id: int) -> int:
+    return conn.execute("SELECT rev FROM boards WHERE id = ?", (board_id,)).fetchone()["rev"]
+
+def board_exists(board_id: int) -> bool:
+    conn = get_db()
+    row = conn.execute("SELECT id FROM boards WHERE id = ?", (board_id,)).fetchone()
     conn.close()
+    return row is not None
+
+# --------- Zdarzenia na żywo (WebSocket) ---------
+class Hub:
+    """Fan-out w procesie: kanał -> bufory podłączonych klientów.
+
+    Klient to asyncio.Queue z gotowymi wiadomościami (JSON serializowany raz na
+    zdarzenie, nie raz na klienta). publish() można wołać z wątków puli i wątku
+    w tle; dostarczenie odbywa się w pętli zdarzeń. Klient z pełnym buforem jest
+    rozłączany - po ponownym połączeniu dociąga zmiany przez /api/boards/{id}?since=.
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.channels: dict[str, set[asyncio.Queue]] = {}
+        self.dropped = 0
+
+    def subscribe(self, channel: str):
+        self.loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.channels.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel: str, q: asyncio.Queue):
+        subs = self.channels.get(channel)
+        if subs is not None:
+            subs.discard(q)
+            if not subs:
+                del self.channels[channel]
+
+    def publish(self, channel: str, data):
+        if self.loop is None or channel not in self.channels:
+            return
+        msg = json.dumps(data, ensure_ascii=False)
+        self.loop.call_soon_threadsafe(self._deliver, channel, msg)
+
+    def _deliver(self, channel: str, msg: str):
+        for q in list(self.channels.get(channel, ())):
+            try:
+                q.put_nowait(msg)
+            except asyncio.QueueFull:
+                # zbyt wolny odbiorca - czyścimy bufor i kończymy jego połączenie
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+                self.unsubscribe(channel, q)
+                self.dropped += 1
+
+hub = Hub()
+
+async def ws_stream(ws: WebSocket, channel: str):
+    await ws.accept()
+    q = hub.subscribe(channel)
+
+    async def close_1013():
+        # 1013 = "try again later": klient łączy się ponownie i robi resync;
+        # zamknięcie też ma limit czasu, bo zablokowany klient może nie odebrać ramki
+        try:
+            await asyncio.wait_for(ws.close(code=1013), WS_SEND_TIMEOUT)
+        except (asyncio.TimeoutError, RuntimeError):
+            pass
+
+    async def sender():
+        while True:
+            msg = await q.get()
+            if msg is None:
+                await close_1013()
+                return
+            try:
+                await asyncio.wait_for(ws.send_text(msg), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                # wysyłka utknęła (klient nie odbiera) - rozłączamy jak przy pełnym buforze
+                hub.dropped += 1
+                await close_1013()
+                return
+
+    async def receiver():
+        # klient nic nie wysyła; czytamy tylko po to, żeby zauważyć rozłączenie
+        while True:
+            if (await ws.receive())["type"] == "websocket.disconnect":
+                return
+
+    tasks = [asyncio.create_task(sender()), asyncio.create_task(receiver())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        hub.unsubscribe(channel, q)
+
+rebalance_pending: set[tuple[int, int]] = set()  # (board_id, col_id)
+rebalance_lock = threading.Lock()
+rebalance_wakeup = threading.Event()
+board_maintenance_stop = threading.Event()
+
+def schedule_rebalance(board_id: int, col_id: int, rank: str):
+    if len(rank) <= RANK_MAX_LEN:
+        return
+    with rebalance_lock:
+        rebalance_pending.add((board_id, col_id))
+    rebalance_wakeup.set()
+
+def board_maintenance_loop():
+    while not board_maintenance_stop.is_set():
+        rebalance_wakeup.wait(RANK_REBALANCE_INTERVAL)
+        rebalance_wakeup.clear()
+        with rebalance_lock:
+            pending = sorted(rebalance_pending)
+            rebalance_pending.clear()
+        for board_id, col_id in pending:
+            conn = get_db()
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+                rebalance_column(conn, board_id, col_id)
+                rev = current_rev(conn, board_id)
+                conn.commit()
+                # wiele kluczy naraz - klienci dociągają zmiany przez /api/boards/{id}?since=
+                hub.publish(f"board:{board_id}", {"type": "resync", "rev": rev})
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"rank rebalance of column {col_id} failed: {e}")
+            finally:
+                conn.close()
+
+        conn = get_db()
+        try:
+            if prune_tombstones(conn, TOMBSTONE_KEEP):
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"tombstone pruning failed: {e}")
+        finally:
+            conn.close()
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    board_maintenance_stop.clear()
+    threading.Thread(target=board_maintenance_loop, name="board-maintenance", daemon=True).start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    board_maintenance_stop.set()
+    rebalance_wakeup.set()
 
 # --------- Schemy ---------
+class BoardIn(BaseModel):
+    name: str = Field(min_length=1)
+
 class TaskIn(BaseModel):
     title: str = Field(min_length=1)
     col_id: int
 
 class TaskMoveIn(BaseModel):
     col_id: int
-    ord: int = Field(ge=1)
+    ord: int = Field(ge=1)  # docelowa pozycja w kolumnie (1 = na górze)
 
-# --------- Board ---------
-@app.get("/api/board")
-def get_board():
+# --------- Boards ---------
+@app.get("/api/boards")
+def list_boards(
+    limit: int = Query(default=PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    after_id: int | None = Query(default=None, ge=0),
+):
     conn = get_db()
-    cols = conn.execute(
-        "SELECT id, name, ord FROM columns ORDER BY ord"
-    ).fetchall()
-    tasks = conn.execute(
-        "SELECT id, title, col_id, ord FROM tasks ORDER BY col_id, ord"
+    rows = conn.execute(
+        "SELECT id, name FROM boards WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id or 0, limit + 1),
     ).fetchall()
     conn.close()
+    return page(rows, limit)
+
+@app.post("/api/boards", status_code=201)
+def add_board(b: BoardIn):
+    conn = get_db()
+    board_id = create_board(conn, b.name.strip())
+    conn.commit()
+    conn.close()
+    return {"id": board_id}
+
+@app.get("/api/boards/{board_id}")
+def get_board(board_id: int, since: int | None = Query(default=None, ge=0)):
+    conn = get_db()
+    try:
+        # jedna transakcja odczytu: rewizja i zmiany pochodzą z tego samego stanu bazy
+        conn.execute("BEGIN;")
+        board = conn.execute(
+            "SELECT id, name, rev, pruned_rev FROM boards WHERE id = ?", (board_id,)
+        ).fetchone()
+        if not board:
+            raise HTTPException(status_code=404, detail="board not found")
+
+        if since is not None and board["pruned_rev"] <= since <= board["rev"]:
+            tasks = conn.execute("""
+              SELECT id, title, col_id, rank FROM tasks
+              WHERE board_id = ? AND rev > ?
+              ORDER BY col_id, rank, id
+            """, (board_id, since)).fetchall()
+            deleted = conn.execute("""
+              SELECT task_id FROM task_tombstones
+              WHERE board_id = ? AND rev > ?
+              ORDER BY task_id
+            """, (board_id, since)).fetchall()
+            return {
+                "rev": board["rev"],
+                "full": False,
+                "tasks": [dict(t) for t in tasks],
+                "deleted": [r["task_id"] for r in deleted],
+            }
+
+        # pierwsze wczytanie albo rewizja klienta sprzed przycięcia tombstone'ów
+        cols = conn.execute(
+            "SELECT id, name, ord FROM columns WHERE board_id = ? ORDER BY ord",
+            (board_id,),
+        ).fetchall()
+        tasks = conn.execute("""
+          SELECT id, title, col_id, rank FROM tasks
+          WHERE board_id = ?
+          ORDER BY col_id, rank, id
+        """, (board_id,)).fetchall()
+        return {
+            "board": {"id": board["id"], "name": board["name"]},
+            "rev": board["rev"],
+            "full": True,
+            "cols": [dict(c) for c in cols],
+            "tasks": [dict(t) for t in tasks],
+        }
+    finally:
+        conn.rollback()
+        conn.close()
+
+@app.websocket("/api/boards/{board_id}/ws")
+async def board_ws(ws: WebSocket, board_id: int):
+    if not await run_in_threadpool(board_exists, board_id):
+        await ws.close(code=1008)
+        return
+    await ws_stream(ws, f"board:{board_id}")
+
+@app.get("/api/boards/ws/stats")
+def board_ws_stats():
     return {
-        "cols": [dict(c) for c in cols],
-        "tasks": [dict(t) for t in tasks],
+        "boards": len(hub.channels),
+        "clients": sum(len(subs) for subs in hub.channels.values()),
+        "dropped": hub.dropped,
     }
 
+# starsze ścieżki jednej tablicy - tablica domyślna
+@app.get("/api/board")
+def get_default_board(since: int | None = Query(default=None, ge=0)):
+    return get_board(DEFAULT_BOARD_ID, since)
+
+@app.websocket("/api/board/ws")
+async def default_board_ws(ws: WebSocket):
+    await board_ws(ws, DEFAULT_BOARD_ID)
+
 # --------- Tasks ---------
+def task_event(conn: sqlite3.Connection, task_id: int):
+    # czytane przed commitem: rev nadany przez trigger w tej samej transakcji
+    row = conn.execute(
+        "SELECT id, title, col_id, rank, rev FROM tasks WHERE id = ?", (task_id,)
+    ).fetchone()
+    task = dict(row)
+    return {"type": "task", "rev": task.pop("rev"), "task": task}
+
 @app.post("/api/tasks", status_code=201)
 def add_task(t: TaskIn):
     conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        col = conn.execute(
+            "SELECT id, board_id FROM columns WHERE id = ?", (t.col_id,)
+        ).fetchone()
+        if not col:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="column not found")
+        board_id = col["board_id"]
 
-    col = conn.execute(
-        "SELECT id FROM columns WHERE id = ?", (t.col_id,)
-    ).fetchone()
-    if not col:
-        conn.close()
-        raise HTTPException(status_code=404, detail="column not found")
-
-    max_ord = conn.execute(
-        "SELECT COALESCE(MAX(ord), 0) AS m FROM tasks WHERE col_id = ?",
-        (t.col_id,),
-    ).fetchone()["m"]
+        # ostatni klucz w kolumnie - jedno zejście po idx_tasks_board_col_rank
+        last = conn.execute("""
+          SELECT rank FROM tasks
+          WHERE board_id = ? AND col_id = ?
+          ORDER BY rank DESC LIMIT 1
+        """, (board_id, t.col_id)).fetchone()
+        rank = rank_between(last["rank"] if last else None, None)
 
-    conn.execute(
-        "INSERT INTO tasks(title, col_id, ord) VALUES(?,?,?)",
-        (t.title.strip(), t.col_id, max_ord + 1),
-    )
-    conn.commit()
-    conn.close()
-    return {"ok": True}
+        cur = conn.execute(
+            "INSERT INTO tasks(title, board_id, col_id, rank) VALUES(?,?,?,?)",
+            (t.title.strip(), board_id, t.col_id, rank),
+        )
+        task = task_event(conn, cur.lastrowid)
+        conn.commit()
+    finally:
+        conn.close()
+    hub.publish(f"board:{board_id}", task)
+    schedule_rebalance(board_id, t.col_id, rank)
+    return {"ok": True, "id": task["task"]["id"]}
 
 @app.post("/api/tasks/{task_id}/move")
 def move_task(task_id: int, m: TaskMoveIn):
     conn = get_db()
+    try:
+        # sąsiedzi i zapis w jednej transakcji - dwa równoległe przeniesienia
+        # nie dostaną tego samego klucza
+        conn.execute("BEGIN IMMEDIATE;")
+        task = conn.execute(
+            "SELECT id, board_id FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        if not task:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="task not found")
+        board_id = task["board_id"]
 
-    task = conn.execute(
-        "SELECT id FROM tasks WHERE id = ?", (task_id,)
-    ).fetchone()
-    if not task:
+        col = conn.execute(
+            "SELECT id, board_id FROM columns WHERE id = ?", (m.col_id,)
+        ).fetchone()
+        if not col:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="column not found")
+        if col["board_id"] != board_id:
+            conn.rollback()
+            raise HTTPException(status_code=409, detail="column belongs to another board")
+
+        # zadania na pozycjach ord-1 i ord w kolumnie docelowej (bez przenoszonego)
+        neighbours = [r["rank"] for r in conn.execute("""
+          SELECT rank FROM tasks
+          WHERE board_id = ? AND col_id = ? AND id <> ?
+          ORDER BY rank, id
+          LIMIT ? OFFSET ?
+        """, (board_id, m.col_id, task_id, 1 if m.ord == 1 else 2, max(m.ord - 2, 0)))]
+        if m.ord == 1:
+            lo, hi = None, neighbours[0] if neighbours else None
+        elif neighbours:
+            lo, hi = neighbours[0], neighbours[1] if len(neighbours) > 1 else None
+        else:
+            # pozycja za końcem kolumny - dopisujemy na koniec
+            last = conn.execute("""
+              SELECT rank FROM tasks
+              WHERE board_id = ? AND col_id = ? AND id <> ?
+              ORDER BY rank DESC LIMIT 1
+            """, (board_id, m.col_id, task_id)).fetchone()
+            lo, hi = (last["rank"] if last else None), None
+        rank = rank_between(lo, hi)
+
+        conn.execute("""
+          UPDATE tasks
+          SET col_id = ?, rank = ?
+          WHERE id = ?
+        """, (m.col_id, rank, task_id))
+        event = task_event(conn, task_id)
+        conn.commit()
+    finally:
         conn.close()
-        raise HTTPException(status_code=404, detail="task not found")
+    hub.publish(f"board:{board_id}", event)
+    schedule_rebalance(board_id, m.col_id, rank)
+    return {"ok": True}
 
-    col = conn.execute(
-        "SELECT id FROM columns WHERE id = ?", (m.col_id,)
-    ).fetchone()
-    if not col:
+@app.delete("/api/tasks/{task_id}")
+def delete_task(task_id: int):
+    conn = get_db()
+    row = conn.execute("DELETE FROM tasks WHERE id = ? RETURNING board_id", (task_id,)).fetchone()
+    if not row:
+        conn.rollback()
         conn.close()
-        raise HTTPException(status_code=404, detail="column not found")
+        raise HTTPException(status_code=404, detail="task not found")
+    rev = current_rev(conn, row["board_id"])
+    conn.commit()
+    conn.close()
+    hub.publish(f"board:{row['board_id']}", {"type": "deleted", "rev": rev, "id": task_id})
+    return {"ok": True}
 
-    # przesuwamy inne zadania w docelowej kolumnie
-    conn.execute("""
-      UPDATE tasks
-      SET ord = ord + 1
-      WHERE col_id = ? AND ord >= ?
-    """, (m.col_id, m.ord))
+# --------- CLI (utrzymanie bazy) ---------
+# docker compose exec api python main.py rebalance-ranks
+if __name__ == "__main__":
+    import argparse
 
-    conn.execute("""
-      UPDATE tasks
-      SET col_id = ?, ord = ?
-      WHERE id = ?
-    """, (m.col_id, m.ord, task_id))
+    parser = argparse.ArgumentParser(description="Lab5 - narzędzia bazy danych")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebalance-ranks", help="przenumeruj klucze kolejności zadań we wszystkich kolumnach")
+    prune = sub.add_parser("prune-tombstones", help="usuń stare tombstone'y usuniętych zadań")
+    prune.add_argument("--keep", type=int, default=TOMBSTONE_KEEP, help="ile najnowszych zostawić na tablicę")
+    args = parser.parse_args()
 
-    conn.commit()
+    init_db()
+    conn = get_db()
+    if args.cmd == "rebalance-ranks":
+        conn.execute("BEGIN IMMEDIATE;")
+        n = sum(
+            rebalance_column(conn, r["board_id"], r["id"])
+            for r in conn.execute("SELECT id, board_id FROM columns").fetchall()
+        )
+        conn.commit()
+        print(f"rebalanced ranks of {n} task(s)")
+    elif args.cmd == "prune-tombstones":
+        n = prune_tombstones(conn, args.keep)
+        conn.commit()
+        print(f"pruned {n} tombstone(s)")
     conn.close()
-    return {"ok": True}
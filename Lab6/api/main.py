@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from datetime import datetime, timezone
+from typing import Literal
+import json
+import re
 import sqlite3
 import os
 
 DB_PATH = os.environ.get("DB_PATH", "/data/notes.db")
 
+SEARCH_LIMIT_DEFAULT = 50
+SEARCH_LIMIT_MAX = 200
+# waga trafienia w tytule względem treści w rankingu BM25
+SEARCH_TITLE_WEIGHT = 10.0
+SNIPPET_TOKENS = 16
+# ranking BM25 liczony jest najwyżej dla tylu najnowszych trafień - koszt zapytania
+# o słowo występujące w większości notatek nie rośnie z rozmiarem bazy
+SEARCH_RANK_WINDOW = int(os.environ.get("SEARCH_RANK_WINDOW", "10000"))
+# długości prefiksów indeksowanych przez FTS5 (zmiana przebudowuje indeks przy starcie)
+SEARCH_PREFIX = "prefix = '1 2 3'"
+# maksymalna liczba notatek w jednym żądaniu POST /api/notes/tags
+BULK_TAG_MAX_NOTES = 1000
+FACET_LIMIT_DEFAULT = 20
+FACET_LIMIT_MAX = 200
+
 app = FastAPI()
 
 app.add_middleware(
@@ -35,7 +53,8 @@ def init_db():
 
     CREATE TABLE IF NOT EXISTS tags (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
-      name TEXT NOT NULL UNIQUE
+      name TEXT NOT NULL UNIQUE,
+      note_count INTEGER NOT NULL DEFAULT 0
     );
 
     CREATE TABLE IF NOT EXISTS note_tags (
@@ -43,10 +62,113 @@ def init_db():
       tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
       PRIMARY KEY (note_id, tag_id)
     );
+
+    """)
+    ensure_tag_counts(conn)
+    conn.executescript("""
+    -- notatki z danym tagiem (filtr ?tags=); PK (note_id, tag_id) obsługuje tylko kierunek odwrotny
+    CREATE INDEX IF NOT EXISTS idx_note_tags_tag ON note_tags(tag_id, note_id);
+
+    -- najpopularniejsze tagi (facety bez filtra) to przejście po indeksie
+    CREATE INDEX IF NOT EXISTS idx_tags_count ON tags(note_count DESC, name);
+
+    -- liczba notatek z tagiem w tags.note_count, w tej samej transakcji co note_tags;
+    -- usunięcie notatki kasuje jej note_tags (ON DELETE CASCADE), co też odpala trigger
+    CREATE TRIGGER IF NOT EXISTS trg_note_tags_insert AFTER INSERT ON note_tags
+    BEGIN
+      UPDATE tags SET note_count = note_count + 1 WHERE id = NEW.tag_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_note_tags_delete AFTER DELETE ON note_tags
+    BEGIN
+      UPDATE tags SET note_count = note_count - 1 WHERE id = OLD.tag_id;
+    END;
     """)
+    ensure_search_index(conn)
     conn.commit()
     conn.close()
 
+# --------- Liczniki tagów ---------
+def ensure_tag_counts(conn: sqlite3.Connection):
+    # starsze bazy nie mają tags.note_count - dodajemy kolumnę i przeliczamy
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(tags)")}
+    if "note_count" not in cols:
+        conn.execute("ALTER TABLE tags ADD COLUMN note_count INTEGER NOT NULL DEFAULT 0")
+        rebuild_tag_counts(conn)
+
+def rebuild_tag_counts(conn: sqlite3.Connection):
+    cur = conn.execute("""
+      UPDATE tags
+      SET note_count = (SELECT COUNT(*) FROM note_tags WHERE tag_id = tags.id)
+    """)
+    return cur.rowcount
+
+# --------- Wyszukiwanie pełnotekstowe (FTS5) ---------
+def ensure_search_index(conn: sqlite3.Connection):
+    # indeks FTS5 nad notes (external content - tekst nie jest kopiowany), aktualizowany
+    # triggerami; remove_diacritics 2: "gesla" znajduje "gęślą" (poza "ł", które nie ma
+    # rozkładu w Unicode); prefix: szybkie zapytania "a*", "ab*", "abc*" - pierwsze
+    # naciśnięcie klawisza w wyszukiwaniu w trakcie pisania też trafia w indeks
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'"
+    ).fetchone()
+    created = not row or SEARCH_PREFIX not in row["sql"]
+    if row and created:
+        # indeks z innymi długościami prefiksów - tworzymy go od nowa
+        conn.execute("DROP TABLE notes_fts")
+    conn.executescript(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+      title, body,
+      content = 'notes', content_rowid = 'id',
+      tokenize = 'unicode61 remove_diacritics 2',
+      {SEARCH_PREFIX}
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_notes_fts_insert AFTER INSERT ON notes
+    BEGIN
+      INSERT INTO notes_fts(rowid, title, body) VALUES (NEW.id, NEW.title, NEW.body);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_notes_fts_delete AFTER DELETE ON notes
+    BEGIN
+      INSERT INTO notes_fts(notes_fts, rowid, title, body) VALUES ('delete', OLD.id, OLD.title, OLD.body);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_notes_fts_update AFTER UPDATE OF title, body ON notes
+    BEGIN
+      INSERT INTO notes_fts(notes_fts, rowid, title, body) VALUES ('delete', OLD.id, OLD.title, OLD.body);
+      INSERT INTO notes_fts(rowid, title, body) VALUES (NEW.id, NEW.title, NEW.body);
+    END;
+    """)
+    if created:
+        # istniejąca baza - indeksujemy notatki dodane przed FTS
+        rebuild_search_index(conn)
+
+def rebuild_search_index(conn: sqlite3.Connection):
+    conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('optimize')")
+    return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+def search_floor(conn: sqlite3.Connection, match: str, tags: list[str], tag_mode: str) -> int:
+    # najstarsze id w oknie SEARCH_RANK_WINDOW najnowszych trafień (przejście po
+    # doclist w kolejności rowid, bez liczenia bm25); przy mniejszej liczbie trafień - 0
+    tag_sql, tag_params = tag_filter("rowid", tags, tag_mode)
+    row = conn.execute(f"""
+      SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?{tag_sql}
+      ORDER BY rowid DESC LIMIT 1 OFFSET ?
+    """, (match, *tag_params, SEARCH_RANK_WINDOW - 1)).fetchone()
+    return row[0] if row else 0
+
+def fts_query(q: str) -> str | None:
+    # tekst użytkownika -> zapytanie FTS5: słowa w cudzysłowach (bez składni FTS5),
+    # wszystkie muszą wystąpić; ostatnie jako prefiks, dopóki jest dopisywane
+    # (spacja na końcu = słowo skończone, szukamy dokładnie)
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    match = " ".join(f'"{w}"' for w in words)
+    return match if q[-1].isspace() else match + "*"
+
 @app.on_event("startup")
 def on_startup():
     init_db()
@@ -59,24 +181,83 @@ class NoteIn(BaseModel):
 class TagsIn(BaseModel):
     tags: list[str]
 
+class BulkTagsIn(BaseModel):
+    note_ids: list[int] = Field(min_length=1, max_length=BULK_TAG_MAX_NOTES)
+    tags: list[str]
+
+def normalize_tags(names) -> list[str]:
+    # ta sama normalizacja przy zapisie i filtrowaniu; bez pustych i duplikatów
+    return list(dict.fromkeys(n for n in (name.strip().lower() for name in names) if n))
+
+def tag_filter(column: str, tags: list[str], mode: str):
+    # warunek "AND column IN (notatki z tagami)": all - notatka ma każdy z tagów, any - choć
+    # jeden; czyta idx_note_tags_tag (tag_id, note_id) tylko dla podanych tagów
+    if not tags:
+        return "", []
+    if mode == "all":
+        return f""" AND {column} IN (
+          SELECT nt.note_id FROM tags t JOIN note_tags nt ON nt.tag_id = t.id
+          WHERE t.name IN (SELECT value FROM json_each(?))
+          GROUP BY nt.note_id HAVING COUNT(*) = ?
+        )""", [json.dumps(tags), len(tags)]
+    return f""" AND {column} IN (
+          SELECT nt.note_id FROM tags t JOIN note_tags nt ON nt.tag_id = t.id
+          WHERE t.name IN (SELECT value FROM json_each(?))
+        )""", [json.dumps(tags)]
+
 # --------- Notes ---------
 @app.get("/api/notes")
-def list_notes(q: str | None = None):
+def list_notes(
+    q: str | None = None,
+    limit: int = Query(default=SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+    tags: str | None = None,
+    tag_mode: Literal["all", "any"] = "all",
+):
+    # tags=a,b - tylko notatki z tagami (tag_mode=all: wszystkimi, any: którymkolwiek)
+    names = normalize_tags(tags.split(",")) if tags else []
+
     conn = get_db()
     if q:
-        like = f"%{q}%"
-        rows = conn.execute("""
-          SELECT id, title, body, created_at
-          FROM notes
-          WHERE title LIKE ? OR body LIKE ?
-          ORDER BY id DESC
-        """, (like, like)).fetchall()
+        match = fts_query(q)
+        if match is None:
+            conn.close()
+            return []
+        floor = search_floor(conn, match, names, tag_mode)
+
+        # wyniki wg trafności (bm25: mniejszy = lepszy). ORDER BY rank sortuje samo FTS5,
+        # więc snippet/highlight liczone są tylko dla `limit` wierszy, nie dla wszystkich
+        # trafień; limit dotyczy tylko wyszukiwania
+        tag_sql, tag_params = tag_filter("notes_fts.rowid", names, tag_mode)
+        rows = conn.execute(f"""
+          SELECT
+            n.id,
+            n.title,
+            n.body,
+            n.created_at,
+            highlight(notes_fts, 0, '<mark>', '</mark>') AS title_hl,
+            snippet(notes_fts, 1, '<mark>', '</mark>', '…', ?) AS snippet,
+            -rank AS score
+          FROM notes_fts
+          JOIN notes n ON n.id = notes_fts.rowid
+          WHERE notes_fts MATCH ? AND rank MATCH ? AND notes_fts.rowid >= ?{tag_sql}
+          ORDER BY rank
+          LIMIT ?
+        """, (
+            SNIPPET_TOKENS,
+            match,
+            f"bm25({SEARCH_TITLE_WEIGHT}, 1.0)",
+            floor,
+            *tag_params,
+            limit,
+        )).fetchall()
     else:
-        rows = conn.execute("""
+        tag_sql, tag_params = tag_filter("id", names, tag_mode)
+        rows = conn.execute(f"""
           SELECT id, title, body, created_at
           FROM notes
+          WHERE 1{tag_sql}
           ORDER BY id DESC
-        """).fetchall()
+        """, tag_params).fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
@@ -92,48 +273,162 @@ def add_note(n: NoteIn):
     conn.close()
     return {"id": new_id}
 
+@app.delete("/api/notes/{note_id}", status_code=204)
+def delete_note(note_id: int):
+    # note_tags znikają kaskadowo, triggery zmniejszają tags.note_count i czyszczą FTS
+    conn = get_db()
+    cur = conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+    conn.commit()
+    conn.close()
+    if cur.rowcount == 0:
+        raise HTTPException(status_code=404, detail="note not found")
+
 # --------- Tags ---------
 @app.get("/api/tags")
 def list_tags():
+    # note_count utrzymywany triggerami na note_tags - bez agregacji przy odczycie
     conn = get_db()
     rows = conn.execute(
-        "SELECT id, name FROM tags ORDER BY name"
+        "SELECT id, name, note_count FROM tags ORDER BY name"
     ).fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
+@app.get("/api/tags/facets")
+def tag_facets(
+    q: str | None = None,
+    tags: str | None = None,
+    tag_mode: Literal["all", "any"] = "all",
+    limit: int = Query(default=FACET_LIMIT_DEFAULT, ge=1, le=FACET_LIMIT_MAX),
+):
+    # liczby notatek per tag w bieżącym widoku (te same q / tags / tag_mode co /api/notes)
+    names = normalize_tags(tags.split(",")) if tags else []
+    conn = get_db()
+    if not q and not names:
+        # bez filtra: gotowe liczniki, najpopularniejsze z idx_tags_count
+        rows = conn.execute("""
+          SELECT id, name, note_count AS count
+          FROM tags
+          WHERE note_count > 0
+          ORDER BY note_count DESC, name
+          LIMIT ?
+        """, (limit,)).fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    if q:
+        match = fts_query(q)
+        if match is None:
+            conn.close()
+            return []
+        # to samo okno najnowszych trafień co ranking wyszukiwania - koszt ograniczony
+        # przez SEARCH_RANK_WINDOW także dla częstych słów
+        tag_sql, tag_params = tag_filter("rowid", names, tag_mode)
+        notes_sql = f"SELECT rowid FROM notes_fts WHERE notes_fts MATCH ? AND rowid >= ?{tag_sql}"
+        notes_params = [match, search_floor(conn, match, names, tag_mode), *tag_params]
+    else:
+        tag_sql, tag_params = tag_filter("id", names, tag_mode)
+        notes_sql = f"SELECT id FROM notes WHERE 1{tag_sql}"
+        notes_params = tag_params
+
+    # tylko tagi notatek z widoku: PK note_tags (note_id, tag_id) dla każdej z nich,
+    # bez złączenia całej note_tags z notes
+    rows = conn.execute(f"""
+      SELECT t.id, t.name, COUNT(*) AS count
+      FROM note_tags nt
+      JOIN tags t ON t.id = nt.tag_id
+      WHERE nt.note_id IN ({notes_sql})
+      GROUP BY t.id
+      ORDER BY count DESC, t.name
+      LIMIT ?
+    """, (*notes_params, limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def assign_tags(conn: sqlite3.Connection, note_ids: list[int], names: list[str]) -> int:
+    # dwa zapytania niezależnie od liczby tagów i notatek: brakujące tagi (upsert; filtr
+    # NOT IN, żeby konflikty nie zużywały numerów AUTOINCREMENT), potem pary notatka x tag;
+    # istniejące przypisania są pomijane
+    names_json = json.dumps(names)
+    conn.execute("""
+      INSERT INTO tags(name)
+      SELECT value FROM json_each(?) WHERE value NOT IN (SELECT name FROM tags)
+      ON CONFLICT(name) DO NOTHING
+    """, (names_json,))
+    cur = conn.execute("""
+      INSERT OR IGNORE INTO note_tags(note_id, tag_id)
+      SELECT n.value, t.id
+      FROM json_each(?) n
+      JOIN tags t ON t.name IN (SELECT value FROM json_each(?))
+    """, (json.dumps(note_ids), names_json))
+    return cur.rowcount
+
 @app.post("/api/notes/{note_id}/tags")
 def set_tags(note_id: int, t: TagsIn):
     conn = get_db()
+    try:
+        # sprawdzenie notatki i zapis w jednej transakcji - usunięcie notatki
+        # w międzyczasie nie skończy się błędem klucza obcego
+        conn.execute("BEGIN IMMEDIATE;")
+        note = conn.execute(
+            "SELECT id FROM notes WHERE id = ?", (note_id,)
+        ).fetchone()
+        if not note:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="note not found")
 
-    note = conn.execute(
-        "SELECT id FROM notes WHERE id = ?", (note_id,)
-    ).fetchone()
-    if not note:
+        names = normalize_tags(t.tags)
+        if names:
+            assign_tags(conn, [note_id], names)
+        conn.commit()
+    finally:
         conn.close()
-        raise HTTPException(status_code=404, detail="note not found")
+    return {"ok": True}
 
-    for name in t.tags:
-        name = name.strip().lower()
-        if not name:
-            continue
+@app.post("/api/notes/tags")
+def bulk_tag_notes(t: BulkTagsIn):
+    # te same tagi dla wielu notatek naraz (do BULK_TAG_MAX_NOTES), jedna transakcja
+    # obejmuje też sprawdzenie, że wszystkie notatki istnieją
+    note_ids = list(dict.fromkeys(t.note_ids))
+    names = normalize_tags(t.tags)
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        missing = [r[0] for r in conn.execute("""
+          SELECT j.value FROM json_each(?) j
+          LEFT JOIN notes n ON n.id = j.value
+          WHERE n.id IS NULL
+        """, (json.dumps(note_ids),))]
+        if missing:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail=f"notes not found: {missing[:20]}")
 
-        row = conn.execute(
-            "SELECT id FROM tags WHERE name = ?", (name,)
-        ).fetchone()
-        if not row:
-            cur = conn.execute(
-                "INSERT INTO tags(name) VALUES(?)", (name,)
-            )
-            tag_id = cur.lastrowid
-        else:
-            tag_id = row["id"]
-
-        conn.execute(
-            "INSERT OR IGNORE INTO note_tags(note_id, tag_id) VALUES(?,?)",
-            (note_id, tag_id),
-        )
+        added = assign_tags(conn, note_ids, names) if names else 0
+        conn.commit()
+    finally:
+        conn.close()
+    return {"notes": len(note_ids), "tags": len(names), "added": added}
 
-    conn.commit()
+# --------- CLI (utrzymanie bazy) ---------
+# docker compose exec api python main.py rebuild-search
+# docker compose exec api python main.py rebuild-tag-counts
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lab6 - narzędzia bazy danych")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild-search", help="przebuduj indeks FTS5 notatek z tabeli notes")
+    sub.add_parser("rebuild-tag-counts", help="przelicz tags.note_count z tabeli note_tags")
+    args = parser.parse_args()
+
+    init_db()
+    conn = get_db()
+    if args.cmd == "rebuild-search":
+        n = rebuild_search_index(conn)
+        conn.commit()
+        print(f"indexed {n} note(s)")
+    elif args.cmd == "rebuild-tag-counts":
+        n = rebuild_tag_counts(conn)
+        conn.commit()
+        print(f"recounted {n} tag(s)")
     conn.close()
-    return {"ok": True}
@@ -0,0 +1,98 @@
+"""Benchmark wyszukiwania notatek: LIKE '%q%' vs FTS5.
+
+Generuje `--notes` notatek z losowych słów (rozkład zbliżony do Zipfa), a potem
+dla tych samych zapytań mierzy opóźnienie p50/p99 starego wyszukiwania
+(`title LIKE ? OR body LIKE ?`, skan całej tabeli) i list_notes(q=...) z api/main.py
+(FTS5 + bm25, LIMIT). Zapytania: rzadkie i częste słowa, dwa słowa, prefiks (3 litery i 1 litera).
+
+Uruchomienie (z katalogu Lab6):
+    python bench/bench_search.py --notes 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=int, default=200000, help="liczba notatek")
+    parser.add_argument("--rounds", type=int, default=20, help="powtórzenia każdego zapytania")
+    parser.add_argument("--like-rounds", type=int, default=3, help="powtórzenia dla LIKE (wolne)")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DB_PATH"] = os.path.join(tmp.name, "notes.db")
+    sys.path.insert(0, API_DIR)
+    import main as api
+
+    rng = random.Random(42)
+    letters = "aąbcćdeęfghijklłmnńoóprsśtuwyzźż"
+    vocab = list(dict.fromkeys(
+        "".join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(25000)
+    ))[:20000]
+    cum_weights = list(accumulate(1 / (i + 1) for i in range(len(vocab))))
+
+    def text(n):
+        return " ".join(rng.choices(vocab, cum_weights=cum_weights, k=n))
+
+    api.init_db()
+    conn = api.get_db()
+    t0 = time.perf_counter()
+    batch = 10000
+    for start in range(0, args.notes, batch):
+        conn.executemany(
+            "INSERT INTO notes(title, body, created_at) VALUES(?, ?, '2025-01-01T00:00:00+00:00')",
+            [(text(4), text(60)) for _ in range(min(batch, args.notes - start))],
+        )
+    conn.commit()
+    print(f"notes={args.notes} generated+indexed in {time.perf_counter() - t0:.1f}s")
+
+    # spacja na końcu = słowo skończone (bez prefiksu), jak w UI po dopisaniu słowa
+    queries = {
+        "rare": f"{vocab[15000]} ",
+        "common": f"{vocab[3]} ",
+        "two words": f"{vocab[10]} {vocab[200]} ",
+        "prefix": vocab[1234][:3],
+        # pierwsze naciśnięcie klawisza w wyszukiwaniu w trakcie pisania
+        "1 letter": vocab[1234][:1],
+        "1 letter ę": "ę",
+    }
+
+    def like_search(q):
+        like = f"%{q.strip()}%"
+        return conn.execute(
+            "SELECT id FROM notes WHERE title LIKE ? OR body LIKE ? ORDER BY id DESC",
+            (like, like),
+        ).fetchall()
+
+    print(f"{'query':<10} {'variant':<6} {'hits':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for label, q in queries.items():
+        for variant, fn, rounds in (
+            ("like", like_search, args.like_rounds),
+            ("fts5", lambda q: api.list_notes(q=q, limit=api.SEARCH_LIMIT_DEFAULT), args.rounds),
+        ):
+            times = []
+            for _ in range(rounds):
+                t = time.perf_counter()
+                hits = len(fn(q))
+                times.append(time.perf_counter() - t)
+            print(f"{label:<10} {variant:<6} {hits:>8} {percentile(times, 50) * 1000:>9.2f} {percentile(times, 99) * 1000:>9.2f}")
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()